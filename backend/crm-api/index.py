@@ -1,14 +1,71 @@
+import base64
 import json
 import os
-import smtplib
+import re
+import uuid
 import psycopg2
 import requests as http_requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from psycopg2.extras import RealDictCursor
+from datetime import date, datetime, timedelta
+from psycopg2.extras import Json, RealDictCursor
+
+import mailer
+import proposal_templates
 
 SCHEMA = 't_p26758318_mortgage_support_pro'
 
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BULK_IDS = 1000
+
+# Лента изменений (action=changes): строки моложе CHANGES_LAG_SEC не отдаются, чтобы курсор не обогнал
+# транзакции, которые уже поставили updated_at, но ещё не закоммитились
+CHANGES_LAG_SEC = 5
+CHANGES_PAGE_SIZE = 500
+
+# Воронка заявок (action=pipeline_stats): стадии по порядку, как в CRMPipelineTab.tsx;
+# отменённые выпадают из воронки
+PIPELINE_STAGES = ['new', 'contact', 'in_progress', 'showing', 'negotiation', 'completed']
+PIPELINE_PERIODS = ('day', 'week', 'month')
+PIPELINE_DEFAULT_DAYS = 90
+
+# Фильтры списка заявок: параметр запроса -> колонка requests
+REQUEST_FILTERS = {
+    'status': 'r.status',
+    'priority': 'r.priority',
+    'service_type': 'r.service_type',
+    'city': 'r.city',
+}
+
+# Заявка в списках и ленте изменений: поля заявки и основные поля клиента
+REQUEST_COLUMNS = '''
+    r.id, r.city, r.service_type, r.message,
+    r.status, r.priority, r.created_at, r.updated_at,
+    r.property_type, r.property_address, r.property_cost,
+    r.initial_payment, r.credit_term, r.additional_info,
+    c.id as client_id, c.name, c.full_name, c.phone, c.email, c.source,
+    c.birth_date, c.monthly_income, c.employment_type, c.registration_completed
+'''
+
+# Поля клиента для списков: без паспортных данных и сведений о работе (они — в action=client)
+CLIENT_LIST_COLUMNS = (
+    'id', 'name', 'full_name', 'phone', 'email', 'source', 'registration_completed',
+    'requests_count', 'last_request_at', 'created_at',
+)
+
+# Служебные генерируемые колонки поиска (V0034) — в ответы API не отдаются
+CLIENT_SEARCH_COLUMNS = ('phone_digits', 'search_vector', 'search_text')
+
+# Очередь подборок (proposal_outbox): размер пачки воркера, пауза между попытками, возврат «зависших» задач
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_BACKOFF_BASE_SEC = 60
+OUTBOX_BACKOFF_MAX_SEC = 3600
+OUTBOX_LOCK_TIMEOUT_SEC = 300
+
+WORD_RE = re.compile(r'\w+')
+NON_PHONE_RE = re.compile(r'[^\d\s()+\-]')
+
 def handler(event: dict, context) -> dict:
     '''API для работы с CRM: клиенты, заявки, объекты недвижимости клиентов'''
     method = event.get('httpMethod', 'GET')
@@ -44,31 +101,136 @@ def handler(event: dict, context) -> dict:
             action = params.get('action', 'requests')
 
             if action == 'requests':
+                paginated = any(params.get(k) for k in ('limit', 'cursor', 'count'))
+                limit = None
+                try:
+                    conditions, values = _request_filters(params)
+                    page_conditions = list(conditions)
+                    page_values = list(values)
+                    if paginated:
+                        limit = max(1, min(int(params.get('limit') or PAGE_SIZE), MAX_PAGE_SIZE))
+                        if params.get('cursor'):
+                            after_ts, after_id = _decode_cursor(params['cursor'])
+                            page_conditions.append("(r.created_at, r.id) < (%s, %s)")
+                            page_values += [after_ts, after_id]
+                except ValueError as e:
+                    return _err(400, str(e))
+
+                where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
                 cursor.execute(f"""
-                    SELECT
-                        r.id, r.city, r.service_type, r.message,
-                        r.status, r.priority, r.created_at, r.updated_at,
-                        r.property_type, r.property_address, r.property_cost,
-                        r.initial_payment, r.credit_term, r.additional_info,
-                        c.id as client_id, c.name, c.full_name, c.phone, c.email, c.source,
-                        c.birth_date, c.monthly_income, c.employment_type, c.registration_completed
+                    SELECT {REQUEST_COLUMNS}
                     FROM {SCHEMA}.requests r
                     LEFT JOIN {SCHEMA}.clients c ON r.client_id = c.id
-                    ORDER BY r.created_at DESC
-                """)
-                rows = cursor.fetchall()
-                return _ok([dict(r) for r in rows])
+                    {where}
+                    ORDER BY r.created_at DESC, r.id DESC
+                    {'LIMIT %s' if limit else ''}
+                """, page_values + ([limit + 1] if limit else []))
+                rows = [dict(r) for r in cursor.fetchall()]
+                # Без limit/cursor/count — прежний ответ массивом для старых экранов админки
+                if not paginated:
+                    return _ok(rows)
+
+                next_cursor = None
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+                result = {'requests': rows, 'count': len(rows), 'next_cursor': next_cursor}
+                if params.get('count') == '1':
+                    # Общее число по тем же фильтрам, без курсора — для счётчиков воронки
+                    cursor.execute(f"""
+                        SELECT COUNT(*) AS total FROM {SCHEMA}.requests r
+                        {f"WHERE {' AND '.join(conditions)}" if conditions else ''}
+                    """, values)
+                    result['total'] = cursor.fetchone()['total']
+                return _ok(result)
 
             elif action == 'clients':
+                # requests_count и last_request_at ведёт триггер trg_requests_client_stats
+                if not any(params.get(k) for k in ('limit', 'cursor')):
+                    cursor.execute(f"SELECT * FROM {SCHEMA}.clients ORDER BY created_at DESC")
+                    return _ok([_client_row(r) for r in cursor.fetchall()])
+
+                conditions = []
+                values = []
+                try:
+                    limit = max(1, min(int(params.get('limit') or PAGE_SIZE), MAX_PAGE_SIZE))
+                    if params.get('cursor'):
+                        after_ts, after_id = _decode_cursor(params['cursor'])
+                        conditions.append("(created_at, id) < (%s, %s)")
+                        values += [after_ts, after_id]
+                except ValueError as e:
+                    return _err(400, str(e))
                 cursor.execute(f"""
-                    SELECT c.*, COUNT(r.id) as requests_count
-                    FROM {SCHEMA}.clients c
-                    LEFT JOIN {SCHEMA}.requests r ON c.id = r.client_id
-                    GROUP BY c.id
-                    ORDER BY c.created_at DESC
-                """)
-                rows = cursor.fetchall()
-                return _ok([dict(r) for r in rows])
+                    SELECT {', '.join(CLIENT_LIST_COLUMNS)}
+                    FROM {SCHEMA}.clients
+                    {f"WHERE {' AND '.join(conditions)}" if conditions else ''}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, values + [limit + 1])
+                rows = [dict(r) for r in cursor.fetchall()]
+                next_cursor = None
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+                return _ok({'clients': rows, 'count': len(rows), 'next_cursor': next_cursor})
+
+            elif action == 'client':
+                client_id = params.get('client_id')
+                if not client_id:
+                    return _err(400, 'client_id is required')
+                cursor.execute(f"SELECT * FROM {SCHEMA}.clients WHERE id = %s", (client_id,))
+                client = cursor.fetchone()
+                if not client:
+                    return _err(404, 'client not found')
+                cursor.execute(f"""
+                    SELECT id, city, service_type, message, status, priority, created_at, updated_at,
+                        property_type, property_address, property_cost, initial_payment, credit_term, additional_info
+                    FROM {SCHEMA}.requests
+                    WHERE client_id = %s ORDER BY created_at DESC
+                """, (client_id,))
+                requests_list = [dict(r) for r in cursor.fetchall()]
+                return _ok({'client': _client_row(client), 'requests': requests_list})
+
+            elif action == 'search_clients':
+                query = params.get('q', '').strip()
+                words = WORD_RE.findall(query.lower())
+                if len(query) < 2 or not words:
+                    return _err(400, 'q must be at least 2 characters')
+                try:
+                    limit = max(1, min(int(params.get('limit') or PAGE_SIZE), MAX_PAGE_SIZE))
+                    offset = max(0, int(params.get('offset') or 0))
+                except ValueError:
+                    return _err(400, 'invalid limit or offset')
+
+                columns = ', '.join(CLIENT_LIST_COLUMNS)
+                digits = re.sub(r'\D', '', query)
+                if len(digits) >= 3 and not NON_PHONE_RE.search(query):
+                    # Номер ищется по последним 10 цифрам: +7/8 в начале записаны по-разному
+                    digits = digits[-10:]
+                    cursor.execute(f"""
+                        SELECT {columns}, similarity(phone_digits, %s) AS rank
+                        FROM {SCHEMA}.clients
+                        WHERE phone_digits LIKE %s
+                        ORDER BY rank DESC, id DESC
+                        LIMIT %s OFFSET %s
+                    """, (digits, f'%{digits}%', limit + 1, offset))
+                else:
+                    # Каждое слово — префикс: «иван петр» найдёт «Иванов Пётр»; ILIKE ловит подстроки внутри слов
+                    ts_query = ' & '.join(f'{w}:*' for w in words)
+                    cursor.execute(f"""
+                        SELECT {columns},
+                            ts_rank(search_vector, to_tsquery('simple', %s)) + similarity(search_text, %s) AS rank
+                        FROM {SCHEMA}.clients
+                        WHERE search_vector @@ to_tsquery('simple', %s) OR search_text ILIKE %s
+                        ORDER BY rank DESC, id DESC
+                        LIMIT %s OFFSET %s
+                    """, (ts_query, query.lower(), ts_query, f'%{query.lower()}%', limit + 1, offset))
+                rows = [dict(r) for r in cursor.fetchall()]
+                next_offset = None
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_offset = offset + limit
+                return _ok({'clients': rows, 'count': len(rows), 'next_offset': next_offset})
 
             elif action == 'client_properties':
                 client_id = params.get('client_id')
@@ -81,6 +243,55 @@ def handler(event: dict, context) -> dict:
                 rows = cursor.fetchall()
                 return _ok([dict(r) for r in rows])
 
+            elif action == 'changes':
+                try:
+                    since = _decode_changes_cursor(params.get('since'))
+                    limit = max(1, min(int(params.get('limit') or CHANGES_PAGE_SIZE), CHANGES_PAGE_SIZE))
+                except ValueError as e:
+                    return _err(400, str(e))
+                return _ok(fetch_changes(cursor, since, limit))
+
+            elif action == 'pipeline_stats':
+                period = params.get('period', 'week')
+                if period not in PIPELINE_PERIODS:
+                    return _err(400, f"period must be one of: {', '.join(PIPELINE_PERIODS)}")
+                if not params.get('date_from'):
+                    params['date_from'] = (date.today() - timedelta(days=PIPELINE_DEFAULT_DAYS)).isoformat()
+                try:
+                    conditions, values = _request_filters(params)
+                except ValueError as e:
+                    return _err(400, str(e))
+                return _ok({
+                    'period': period, 'date_from': params['date_from'], 'date_to': params.get('date_to'),
+                    **pipeline_stats(cursor, period, conditions, values),
+                })
+
+            elif action == 'deliver_outbox':
+                # Точка входа воркера очереди подборок (вызывается по расписанию)
+                return _ok({'success': True, **deliver_outbox(cursor)})
+
+            elif action == 'proposal_status':
+                job_id = params.get('job_id')
+                if not job_id:
+                    return _err(400, 'job_id is required')
+                cursor.execute(f"""
+                    SELECT channel, recipient, status, attempts, max_attempts, next_attempt_at,
+                        last_error, sent_at, created_at
+                    FROM {SCHEMA}.proposal_outbox
+                    WHERE job_id = %s ORDER BY id
+                """, (job_id,))
+                deliveries = [dict(r) for r in cursor.fetchall()]
+                if not deliveries:
+                    return _err(404, 'job not found')
+                statuses = {d['status'] for d in deliveries}
+                if statuses == {'sent'}:
+                    status = 'sent'
+                elif statuses & {'pending', 'sending'}:
+                    status = 'pending'
+                else:
+                    status = 'failed'
+                return _ok({'job_id': job_id, 'status': status, 'channels': deliveries})
+
             elif action == 'quiz_stats':
                 cursor.execute(f"""
                     SELECT category, region, loan_amount_range, recommended_program,
@@ -107,113 +318,28 @@ def handler(event: dict, context) -> dict:
                 if not client_id or not properties:
                     return _err(400, 'client_id and properties are required')
 
-                PROPERTY_TYPES = {
-                    'apartment': 'Квартира', 'house': 'Дом', 'land': 'Земельный участок',
-                    'commercial': 'Коммерческая', 'room': 'Комната', 'newbuild': 'Новостройка',
-                }
-
-                def fmt_price(p):
-                    if not p: return ''
-                    return f"{int(p):,}".replace(',', ' ') + ' ₽'
-
-                lines = []
-                lines.append(f'ПОДБОРКА ОБЪЕКТОВ ДЛЯ: {client_name}')
-                if custom_phone: lines.append(f'Телефон: {custom_phone}')
-                if custom_email: lines.append(f'Email: {custom_email}')
-                lines.append(f'Дата: {__import__("datetime").date.today().strftime("%d.%m.%Y")}')
-                lines.append('')
-                lines.append('=' * 50)
-                lines.append('')
-
-                for i, p in enumerate(properties, 1):
-                    lines.append(f'{i}. {p.get("title", "")}')
-                    ptype = PROPERTY_TYPES.get(p.get('property_type', ''), p.get('property_type', ''))
-                    if ptype: lines.append(f'   Тип: {ptype}')
-                    if p.get('address'): lines.append(f'   Адрес: {p["address"]}')
-                    details = []
-                    if p.get('area'): details.append(f'{p["area"]} м²')
-                    if p.get('rooms'): details.append(f'{p["rooms"]} комн.')
-                    if p.get('floor') and p.get('total_floors'): details.append(f'{p["floor"]}/{p["total_floors"]} эт.')
-                    elif p.get('floor'): details.append(f'{p["floor"]} эт.')
-                    if details: lines.append(f'   {" · ".join(details)}')
-                    if p.get('price'): lines.append(f'   Цена: {fmt_price(p["price"])}')
-                    if p.get('description'): lines.append(f'   {p["description"]}')
-                    lines.append('')
-
-                lines.append('-' * 50)
-                lines.append('Ипотека Крым — ваш надёжный партнёр в сфере недвижимости')
-                text = '\n'.join(lines)
-
-                sent = []
-                errors = []
+                rendered = proposal_templates.render_proposal(
+                    client_name, properties, phone=custom_phone, email=custom_email,
+                )
+                text = rendered['text']
 
+                # Содержимое каждого канала уходит в очередь; доставляет deliver_outbox
+                outbox = []
                 if 'email' in channels and custom_email:
-                    try:
-                        smtp_host = os.environ.get('SMTP_HOST', '')
-                        smtp_port = int(os.environ.get('SMTP_PORT', 587))
-                        smtp_user = os.environ.get('SMTP_USER', '')
-                        smtp_pass = os.environ.get('SMTP_PASSWORD', '')
-                        msg = MIMEMultipart('alternative')
-                        msg['Subject'] = f'Подборка объектов для {client_name}'
-                        msg['From'] = smtp_user
-                        msg['To'] = custom_email
-                        html_parts = ['<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto;">']
-                        html_parts.append(f'<h2 style="color:#1a56db;">Подборка объектов для {client_name}</h2>')
-                        html_parts.append(f'<p style="color:#666;">Дата: {__import__("datetime").date.today().strftime("%d.%m.%Y")}</p>')
-                        for i, p in enumerate(properties, 1):
-                            html_parts.append('<div style="border:1px solid #e5e7eb;border-radius:8px;padding:16px;margin:12px 0;">')
-                            html_parts.append(f'<h3 style="margin:0 0 8px;color:#111827;">{i}. {p.get("title","")}</h3>')
-                            ptype = PROPERTY_TYPES.get(p.get('property_type',''), p.get('property_type',''))
-                            if ptype: html_parts.append(f'<p style="margin:4px 0;color:#6b7280;font-size:14px;">Тип: {ptype}</p>')
-                            if p.get('address'): html_parts.append(f'<p style="margin:4px 0;color:#374151;font-size:14px;">📍 {p["address"]}</p>')
-                            details = []
-                            if p.get('area'): details.append(f'{p["area"]} м²')
-                            if p.get('rooms'): details.append(f'{p["rooms"]} комн.')
-                            if p.get('floor') and p.get('total_floors'): details.append(f'{p["floor"]}/{p["total_floors"]} эт.')
-                            if details: html_parts.append(f'<p style="margin:4px 0;color:#374151;font-size:14px;">{" · ".join(details)}</p>')
-                            if p.get('price'): html_parts.append(f'<p style="margin:8px 0 0;font-size:18px;font-weight:bold;color:#059669;">{fmt_price(p["price"])}</p>')
-                            if p.get('description'): html_parts.append(f'<p style="margin:6px 0 0;color:#6b7280;font-size:13px;">{p["description"]}</p>')
-                            html_parts.append('</div>')
-                        html_parts.append('<p style="margin-top:24px;color:#9ca3af;font-size:12px;">Ипотека Крым — ваш надёжный партнёр в сфере недвижимости</p>')
-                        html_parts.append('</div>')
-                        msg.attach(MIMEText('\n'.join(html_parts), 'html', 'utf-8'))
-                        with smtplib.SMTP(smtp_host, smtp_port) as server:
-                            server.starttls()
-                            server.login(smtp_user, smtp_pass)
-                            server.sendmail(smtp_user, custom_email, msg.as_string())
-                        sent.append('email')
-                    except Exception as e:
-                        errors.append(f'email: {str(e)}')
-
+                    outbox.append(('email', custom_email, {'subject': rendered['subject'], 'html': rendered['html']}))
                 if 'telegram' in channels:
-                    try:
-                        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-                        chat_id = os.environ.get('TELEGRAM_CHAT_ID', '')
-                        tg_text = f'📋 *Подборка для {client_name}*\n\n'
-                        for i, p in enumerate(properties, 1):
-                            tg_text += f'*{i}. {p.get("title","")}*\n'
-                            ptype = PROPERTY_TYPES.get(p.get('property_type',''), p.get('property_type',''))
-                            if ptype: tg_text += f'Тип: {ptype}\n'
-                            if p.get('address'): tg_text += f'📍 {p["address"]}\n'
-                            details = []
-                            if p.get('area'): details.append(f'{p["area"]} м²')
-                            if p.get('rooms'): details.append(f'{p["rooms"]} комн.')
-                            if details: tg_text += f'{" · ".join(details)}\n'
-                            if p.get('price'): tg_text += f'💰 {fmt_price(p["price"])}\n'
-                            tg_text += '\n'
-                        resp = http_requests.post(
-                            f'https://api.telegram.org/bot{bot_token}/sendMessage',
-                            json={'chat_id': chat_id, 'text': tg_text, 'parse_mode': 'Markdown'},
-                            timeout=10
-                        )
-                        if resp.status_code == 200:
-                            sent.append('telegram')
-                        else:
-                            errors.append(f'telegram: {resp.text}')
-                    except Exception as e:
-                        errors.append(f'telegram: {str(e)}')
-
-                return _ok({'success': True, 'sent': sent, 'errors': errors, 'text': text})
+                    outbox.append(('telegram', '', {
+                        'messages': rendered['telegram'], 'parse_mode': proposal_templates.TELEGRAM_PARSE_MODE,
+                    }))
+
+                if not outbox:
+                    return _err(400, 'channels must include email (with an address) or telegram')
+                job_id = enqueue_proposal(cursor, client_id, outbox)
+                conn.commit()
+                return _ok({
+                    'success': True, 'job_id': job_id, 'queued': [ch for ch, _, _ in outbox],
+                    'sent': [], 'errors': [], 'text': text,
+                })
 
             elif action == 'update_client':
                 client_id = body.get('client_id')
@@ -228,7 +354,7 @@ def handler(event: dict, context) -> dict:
                     WHERE id=%s
                     RETURNING *
                 """, (name, body.get('phone', ''), body.get('email', ''), body.get('notes', ''), client_id))
-                client = dict(cursor.fetchone())
+                client = _client_row(cursor.fetchone())
                 conn.commit()
                 return _ok({'success': True, 'client': client})
 
@@ -251,7 +377,7 @@ def handler(event: dict, context) -> dict:
                     VALUES (%s, %s, %s, %s, %s)
                     RETURNING *
                 """, (name, phone, body.get('email', ''), body.get('source', 'crm'), body.get('notes', '')))
-                client = dict(cursor.fetchone())
+                client = _client_row(cursor.fetchone())
                 conn.commit()
                 return _ok({'success': True, 'client': client})
 
@@ -305,6 +431,30 @@ def handler(event: dict, context) -> dict:
                 conn.commit()
                 return _ok({'success': True})
 
+            if action == 'bulk_update_requests':
+                try:
+                    ids = _parse_ids(body.get('ids'))
+                except ValueError as e:
+                    return _err(400, str(e))
+                updates = []
+                values = []
+                for field in ('status', 'priority'):
+                    if body.get(field):
+                        updates.append(f"{field} = %s")
+                        values.append(body[field])
+                if not updates:
+                    return _err(400, 'status or priority is required')
+                # Одна транзакция и один UPDATE на весь список, а не вызов функции на каждую заявку
+                cursor.execute(f"""
+                    UPDATE {SCHEMA}.requests
+                    SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s)
+                    RETURNING id, status, priority, updated_at
+                """, values + [ids])
+                updated = [dict(r) for r in cursor.fetchall()]
+                conn.commit()
+                return _ok({'success': True, 'updated': updated, 'count': len(updated)})
+
             # Обновление заявки (старый функционал)
             request_id = body.get('request_id')
             if not request_id:
@@ -351,6 +501,16 @@ def handler(event: dict, context) -> dict:
                 conn.commit()
                 return _ok({'success': True})
 
+            if action == 'bulk_delete_requests':
+                try:
+                    ids = _parse_ids(params.get('ids', '').split(','))
+                except ValueError as e:
+                    return _err(400, str(e))
+                cursor.execute(f"DELETE FROM {SCHEMA}.requests WHERE id = ANY(%s) RETURNING id", (ids,))
+                deleted = [r['id'] for r in cursor.fetchall()]
+                conn.commit()
+                return _ok({'success': True, 'deleted': deleted, 'count': len(deleted)})
+
             request_id = params.get('request_id')
             if not request_id:
                 return _err(400, 'request_id is required')
@@ -368,6 +528,286 @@ def handler(event: dict, context) -> dict:
         conn.close()
 
 
+def fetch_changes(cursor, since: dict, limit: int) -> dict:
+    """Заявки и клиенты, изменённые после курсора (keyset по updated_at, id), и удалённые
+    после него (crm_tombstones). Без since отдаётся всё с начала — это же первичная загрузка."""
+    cursor.execute(f"""
+        SELECT {REQUEST_COLUMNS}
+        FROM {SCHEMA}.requests r
+        LEFT JOIN {SCHEMA}.clients c ON r.client_id = c.id
+        WHERE r.updated_at < NOW() - make_interval(secs => %s) AND (r.updated_at, r.id) > (%s, %s)
+        ORDER BY r.updated_at, r.id
+        LIMIT %s
+    """, (CHANGES_LAG_SEC, *since['requests'], limit + 1))
+    requests_rows = [dict(r) for r in cursor.fetchall()]
+
+    cursor.execute(f"""
+        SELECT {', '.join(CLIENT_LIST_COLUMNS)}, updated_at
+        FROM {SCHEMA}.clients
+        WHERE updated_at < NOW() - make_interval(secs => %s) AND (updated_at, id) > (%s, %s)
+        ORDER BY updated_at, id
+        LIMIT %s
+    """, (CHANGES_LAG_SEC, *since['clients'], limit + 1))
+    clients_rows = [dict(r) for r in cursor.fetchall()]
+
+    cursor.execute(f"""
+        SELECT id, entity, entity_id, deleted_at
+        FROM {SCHEMA}.crm_tombstones
+        WHERE deleted_at < NOW() - make_interval(secs => %s) AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (CHANGES_LAG_SEC, since['deleted'], limit + 1))
+    tombstones = [dict(r) for r in cursor.fetchall()]
+
+    has_more = max(len(requests_rows), len(clients_rows), len(tombstones)) > limit
+    requests_rows, clients_rows, tombstones = requests_rows[:limit], clients_rows[:limit], tombstones[:limit]
+    position = {
+        'requests': (requests_rows[-1]['updated_at'], requests_rows[-1]['id']) if requests_rows else since['requests'],
+        'clients': (clients_rows[-1]['updated_at'], clients_rows[-1]['id']) if clients_rows else since['clients'],
+        'deleted': tombstones[-1]['id'] if tombstones else since['deleted'],
+    }
+    return {
+        'requests': requests_rows,
+        'clients': clients_rows,
+        'deleted': [{'entity': t['entity'], 'id': t['entity_id'], 'deleted_at': t['deleted_at']} for t in tombstones],
+        'next_cursor': _encode_changes_cursor(position),
+        'has_more': has_more,
+    }
+
+
+def pipeline_stats(cursor, period: str, conditions: list, values: list) -> dict:
+    """Сводка воронки одним GROUPING SETS-запросом (статус × период, статус, тип услуги, источник, итог)
+    и медиана времени в стадии по request_status_history. period уже проверен по PIPELINE_PERIODS."""
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    period_expr = f"date_trunc('{period}', r.created_at)"
+    cursor.execute(f"""
+        SELECT {period_expr} AS period, r.status, r.service_type, c.source, COUNT(*) AS count,
+            GROUPING({period_expr}, r.status, r.service_type, c.source) AS grouping_id
+        FROM {SCHEMA}.requests r
+        LEFT JOIN {SCHEMA}.clients c ON r.client_id = c.id
+        {where}
+        GROUP BY GROUPING SETS (({period_expr}, r.status), (r.status), (r.service_type), (c.source), ())
+    """, values)
+
+    # grouping_id — битовая маска неучтённых колонок: period=8, status=4, service_type=2, source=1
+    total = 0
+    by_status, by_service_type, by_source, by_period = {}, {}, {}, {}
+    for row in cursor.fetchall():
+        gid = row['grouping_id']
+        if gid == 3:
+            bucket = by_period.setdefault(row['period'].date().isoformat(), {})
+            bucket[row['status'] or 'unknown'] = row['count']
+        elif gid == 11:
+            by_status[row['status'] or 'unknown'] = row['count']
+        elif gid == 13:
+            by_service_type[row['service_type'] or 'unknown'] = row['count']
+        elif gid == 14:
+            by_source[row['source'] or 'unknown'] = row['count']
+        elif gid == 15:
+            total = row['count']
+
+    # Воронка линейная: дошедшие до стадии — те, кто сейчас в ней или дальше
+    reached = {stage: sum(by_status.get(s, 0) for s in PIPELINE_STAGES[i:]) for i, stage in enumerate(PIPELINE_STAGES)}
+    reached[PIPELINE_STAGES[0]] = total
+    conversion = {
+        f'{a}_to_{b}': round(reached[b] / reached[a], 4) if reached[a] else None
+        for a, b in zip(PIPELINE_STAGES, PIPELINE_STAGES[1:])
+    }
+    conversion['completion_rate'] = round(by_status.get('completed', 0) / total, 4) if total else None
+    conversion['cancellation_rate'] = round(by_status.get('cancelled', 0) / total, 4) if total else None
+
+    cursor.execute(f"""
+        SELECT h.status, COUNT(*) AS transitions,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM h.left_at - h.entered_at)) AS median_sec
+        FROM {SCHEMA}.request_status_history h
+        JOIN {SCHEMA}.requests r ON r.id = h.request_id
+        WHERE h.left_at IS NOT NULL {f"AND {' AND '.join(conditions)}" if conditions else ''}
+        GROUP BY h.status
+    """, values)
+    time_in_stage = {
+        row['status'] or 'unknown': {
+            'transitions': row['transitions'],
+            'median_hours': round(row['median_sec'] / 3600, 1) if row['median_sec'] is not None else None,
+        }
+        for row in cursor.fetchall()
+    }
+
+    return {
+        'total': total,
+        'by_status': by_status,
+        'by_service_type': by_service_type,
+        'by_source': by_source,
+        'by_period': [{'period': k, **v} for k, v in sorted(by_period.items())],
+        'conversion': conversion,
+        'time_in_stage': time_in_stage,
+    }
+
+
+def enqueue_proposal(cursor, client_id, outbox: list) -> str:
+    """Ставит подборку в proposal_outbox: одна строка на канал, общий job_id"""
+    job_id = str(uuid.uuid4())
+    for channel, recipient, payload in outbox:
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.proposal_outbox (job_id, client_id, channel, recipient, payload)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (job_id, client_id, channel, recipient, Json(payload)))
+    return job_id
+
+
+def deliver_outbox(cursor) -> dict:
+    """Забирает пачку готовых к отправке задач (SKIP LOCKED — параллельные воркеры не пересекаются),
+    доставляет и фиксирует итог каждой отдельно. Неудача — повтор с экспоненциальной паузой,
+    пока не исчерпаны max_attempts. Задачи упавшего воркера возвращаются через OUTBOX_LOCK_TIMEOUT_SEC."""
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.proposal_outbox
+        SET status = 'sending', attempts = attempts + 1, locked_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.proposal_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+               OR (status = 'sending' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, channel, recipient, payload, attempts, max_attempts
+    """, (OUTBOX_LOCK_TIMEOUT_SEC, OUTBOX_BATCH_SIZE))
+    jobs = cursor.fetchall()
+    cursor.connection.commit()
+
+    stats = {'claimed': len(jobs), 'sent': 0, 'retried': 0, 'failed': 0}
+    for job in jobs:
+        try:
+            OUTBOX_CHANNELS[job['channel']](job['recipient'], job['payload'])
+        except Exception as e:
+            final = job['attempts'] >= job['max_attempts']
+            delay = min(OUTBOX_BACKOFF_BASE_SEC * 2 ** (job['attempts'] - 1), OUTBOX_BACKOFF_MAX_SEC)
+            # payload сохраняется вместе с прогрессом канала (sent_messages), чтобы повтор продолжил с места сбоя
+            cursor.execute(f"""
+                UPDATE {SCHEMA}.proposal_outbox
+                SET status = %s, last_error = %s, locked_at = NULL, payload = %s,
+                    next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE id = %s
+            """, ('failed' if final else 'pending', str(e)[:1000], Json(job['payload']), delay, job['id']))
+            stats['failed' if final else 'retried'] += 1
+        else:
+            cursor.execute(f"""
+                UPDATE {SCHEMA}.proposal_outbox
+                SET status = 'sent', sent_at = CURRENT_TIMESTAMP, locked_at = NULL, last_error = NULL
+                WHERE id = %s
+            """, (job['id'],))
+            stats['sent'] += 1
+        # Итог фиксируется сразу: если функция оборвётся по таймауту, доставленное не уйдёт повторно
+        cursor.connection.commit()
+    return stats
+
+
+def _send_email(recipient: str, payload: dict) -> None:
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = payload['subject']
+    msg['From'] = mailer.sender()
+    msg['To'] = recipient
+    msg.attach(MIMEText(payload['html'], 'html', 'utf-8'))
+    # Соединение с SMTP тёплое между вызовами в одном контейнере (mailer)
+    mailer.send_message(msg)
+
+
+def _send_telegram(recipient: str, payload: dict) -> None:
+    """Длинная подборка уходит несколькими сообщениями. Число доставленных пишется в
+    payload['sent_messages']: при повторе после сбоя уже отправленные сообщения не дублируются.
+    'text' и Markdown — задачи, поставленные до разбиения на сообщения."""
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    chat_id = recipient or os.environ.get('TELEGRAM_CHAT_ID', '')
+    messages = payload.get('messages') or [payload['text']]
+    for index in range(payload.get('sent_messages', 0), len(messages)):
+        resp = http_requests.post(
+            f'https://api.telegram.org/bot{bot_token}/sendMessage',
+            json={'chat_id': chat_id, 'text': messages[index], 'parse_mode': payload.get('parse_mode', 'Markdown')},
+            timeout=10
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(resp.text)
+        payload['sent_messages'] = index + 1
+
+
+OUTBOX_CHANNELS = {'email': _send_email, 'telegram': _send_telegram}
+
+
+def _parse_ids(raw) -> list:
+    """Список id для массовых операций: целые числа, без повторов, не больше MAX_BULK_IDS"""
+    if not isinstance(raw, list):
+        raise ValueError('ids must be a list')
+    try:
+        ids = sorted({int(i) for i in raw if str(i).strip()})
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+    if not ids:
+        raise ValueError('ids is required')
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f'at most {MAX_BULK_IDS} ids per call')
+    return ids
+
+
+def _client_row(row) -> dict:
+    return {k: v for k, v in row.items() if k not in CLIENT_SEARCH_COLUMNS}
+
+
+def _request_filters(params: dict) -> tuple[list, list]:
+    """Условия WHERE по фильтрам списка заявок (status, priority, service_type, city, date_from, date_to).
+    Даты в формате YYYY-MM-DD, иначе ValueError."""
+    conditions = []
+    values = []
+    for param, column in REQUEST_FILTERS.items():
+        if params.get(param):
+            conditions.append(f"{column} = %s")
+            values.append(params[param])
+    if params.get('date_from'):
+        conditions.append("r.created_at >= %s")
+        values.append(date.fromisoformat(params['date_from']))
+    if params.get('date_to'):
+        # date_to включительно: всё до начала следующего дня
+        conditions.append("r.created_at < %s")
+        values.append(date.fromisoformat(params['date_to']) + timedelta(days=1))
+    return conditions, values
+
+
+def _encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(value: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        ts, row_id = raw.split('|', 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception as e:
+        raise ValueError(f'bad cursor: {value}') from e
+
+
+def _encode_changes_cursor(position: dict) -> str:
+    raw = json.dumps({
+        'r': [position['requests'][0].isoformat(), position['requests'][1]],
+        'c': [position['clients'][0].isoformat(), position['clients'][1]],
+        't': position['deleted'],
+    })
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_changes_cursor(value: str | None) -> dict:
+    if not value:
+        start = (datetime(1970, 1, 1), 0)
+        return {'requests': start, 'clients': start, 'deleted': 0}
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode())
+        return {
+            'requests': (datetime.fromisoformat(raw['r'][0]), int(raw['r'][1])),
+            'clients': (datetime.fromisoformat(raw['c'][0]), int(raw['c'][1])),
+            'deleted': int(raw['t']),
+        }
+    except Exception as e:
+        raise ValueError(f'bad cursor: {value}') from e
+
+
 def _ok(data):
     return {
         'statusCode': 200,
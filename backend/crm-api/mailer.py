@@ -0,0 +1,164 @@
+'''
+Общий почтовый транспорт функций (crm-api, send-newsletter): одно SMTP-соединение на контейнер.
+Файл одинаковый во всех функциях — каждая функция деплоится отдельно, поэтому модуль копируется.
+'''
+import os
+import smtplib
+import socketserver
+import threading
+import time
+
+# Простаивавшее дольше этого соединение перед отправкой проверяется NOOP
+NOOP_AFTER_IDLE_SEC = 10
+CONNECT_TIMEOUT = 15
+
+_smtp = None
+_last_used = 0.0
+_lock = threading.Lock()
+_stub = None
+
+
+def is_configured() -> bool:
+    host = os.environ.get('SMTP_HOST', '')
+    return host == 'stub' or all((host, os.environ.get('SMTP_USER'), os.environ.get('SMTP_PASSWORD')))
+
+
+def sender() -> str:
+    return os.environ.get('SMTP_USER', '')
+
+
+def send_message(msg, to_addrs=None) -> None:
+    '''Отправляет письмо через тёплое соединение; при обрыве переподключается и повторяет один раз'''
+    global _last_used
+    with _lock:
+        for attempt in (1, 2):
+            server = _connection()
+            try:
+                server.send_message(msg, to_addrs=to_addrs)
+                _last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError) as e:
+                # Отказ по конкретному получателю — не проблема соединения, повтор не поможет
+                if isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)) or attempt == 2:
+                    raise
+                _drop()
+
+
+def close() -> None:
+    with _lock:
+        _drop()
+
+
+def _connection() -> smtplib.SMTP:
+    global _smtp, _last_used
+    if _smtp is not None and time.monotonic() - _last_used > NOOP_AFTER_IDLE_SEC:
+        try:
+            alive = _smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            alive = False
+        if not alive:
+            _drop()
+    if _smtp is None:
+        _smtp = _connect()
+        _last_used = time.monotonic()
+    return _smtp
+
+
+def _connect() -> smtplib.SMTP:
+    host = os.environ.get('SMTP_HOST', '')
+    port = int(os.environ.get('SMTP_PORT', 587))
+    if host == 'stub':
+        host, port = _local_stub().address
+    server = smtplib.SMTP(host, port, timeout=CONNECT_TIMEOUT)
+    server.ehlo()
+    if server.has_extn('starttls'):
+        server.starttls()
+        server.ehlo()
+    user = os.environ.get('SMTP_USER', '')
+    if user and server.has_extn('auth'):
+        server.login(user, os.environ.get('SMTP_PASSWORD', ''))
+    return server
+
+
+def _drop() -> None:
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+    _smtp = None
+
+
+def _local_stub():
+    global _stub
+    if _stub is None:
+        _stub = LocalSMTPStub().start()
+    return _stub
+
+
+class LocalSMTPStub:
+    '''Локальный SMTP-сервер для тестов (SMTP_HOST=stub): принимает любые письма и хранит их в messages'''
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.messages = []
+        self._server = socketserver.ThreadingTCPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.messages = self.messages
+        self.address = self._server.server_address
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _StubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self._reply('220 localhost stub ESMTP')
+        envelope = {'from': '', 'to': []}
+        data = None
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    self.server.messages.append({**envelope, 'data': '\n'.join(data)})
+                    envelope = {'from': '', 'to': []}
+                    data = None
+                    self._reply('250 OK queued')
+                else:
+                    data.append(line[1:] if line.startswith('..') else line)
+                continue
+            command = line.split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self._reply('250-localhost', '250-8BITMIME', '250-SMTPUTF8', '250 AUTH PLAIN LOGIN')
+            elif command == 'AUTH':
+                self._reply('235 Authentication successful')
+            elif command == 'MAIL':
+                envelope['from'] = line.split(':', 1)[-1].strip()
+                self._reply('250 OK')
+            elif command == 'RCPT':
+                envelope['to'].append(line.split(':', 1)[-1].strip())
+                self._reply('250 OK')
+            elif command == 'DATA':
+                data = []
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command in ('HELO', 'NOOP', 'RSET'):
+                self._reply('250 OK')
+            elif command == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+    def _reply(self, *lines: str) -> None:
+        self.wfile.write(''.join(f'{line}\r\n' for line in lines).encode())
@@ -0,0 +1,149 @@
+'''
+Шаблоны подборки объектов для send_proposal. Карточка объекта собирается один раз
+и раскладывается по трём каналам: текст, HTML-письмо и Telegram.
+'''
+import html
+from datetime import date
+
+PROPERTY_TYPES = {
+    'apartment': 'Квартира', 'house': 'Дом', 'land': 'Земельный участок',
+    'commercial': 'Коммерческая', 'room': 'Комната', 'newbuild': 'Новостройка',
+}
+
+FOOTER = 'Ипотека Крым — ваш надёжный партнёр в сфере недвижимости'
+
+# Лимит длины одного сообщения Bot API; длинная подборка делится на сообщения по границам карточек.
+# Поля карточки в Telegram обрезаются, чтобы одна карточка всегда помещалась в сообщение целиком
+TELEGRAM_MAX_MESSAGE = 4096
+TELEGRAM_MAX_FIELD = 1000
+
+# HTML, а не Markdown: в Markdown нельзя экранировать символы внутри *жирного* заголовка
+TELEGRAM_PARSE_MODE = 'HTML'
+
+
+def fmt_price(price) -> str:
+    if not price:
+        return ''
+    return f'{int(price):,}'.replace(',', ' ') + ' ₽'
+
+
+def property_card(p: dict) -> dict:
+    '''Поля карточки объекта, общие для всех каналов'''
+    details = []
+    if p.get('area'):
+        details.append(f'{p["area"]} м²')
+    if p.get('rooms'):
+        details.append(f'{p["rooms"]} комн.')
+    if p.get('floor') and p.get('total_floors'):
+        details.append(f'{p["floor"]}/{p["total_floors"]} эт.')
+    elif p.get('floor'):
+        details.append(f'{p["floor"]} эт.')
+    ptype = p.get('property_type') or ''
+    return {
+        'title': str(p.get('title') or ''),
+        'type': PROPERTY_TYPES.get(ptype, ptype),
+        'address': str(p.get('address') or ''),
+        'details': ' · '.join(details),
+        'price': fmt_price(p.get('price')),
+        'description': str(p.get('description') or ''),
+    }
+
+
+def render_proposal(client_name: str, properties: list, phone: str = '', email: str = '') -> dict:
+    '''Подборка во всех каналах: text, html, telegram (список сообщений) и subject письма'''
+    today = date.today().strftime('%d.%m.%Y')
+    cards = [property_card(p) for p in properties]
+
+    text = [f'ПОДБОРКА ОБЪЕКТОВ ДЛЯ: {client_name}']
+    if phone:
+        text.append(f'Телефон: {phone}')
+    if email:
+        text.append(f'Email: {email}')
+    text += [f'Дата: {today}', '', '=' * 50, '']
+    for n, card in enumerate(cards, 1):
+        text.append(_text_card(n, card))
+    text += ['-' * 50, FOOTER]
+
+    page = [
+        '<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto;">',
+        f'<h2 style="color:#1a56db;">Подборка объектов для {html.escape(client_name)}</h2>',
+        f'<p style="color:#666;">Дата: {today}</p>',
+    ]
+    for n, card in enumerate(cards, 1):
+        page.append(_html_card(n, card))
+    page += [f'<p style="margin-top:24px;color:#9ca3af;font-size:12px;">{FOOTER}</p>', '</div>']
+
+    messages = []
+    current = f'📋 <b>Подборка для {_escape_telegram(client_name)}</b>\n\n'
+    for n, card in enumerate(cards, 1):
+        block = _telegram_card(n, card) + '\n\n'
+        if len(current) + len(block) > TELEGRAM_MAX_MESSAGE:
+            messages.append(current)
+            current = ''
+        current += block
+    messages.append(current)
+
+    return {
+        'subject': f'Подборка объектов для {client_name}',
+        'text': '\n'.join(text),
+        'html': '\n'.join(page),
+        'telegram': messages,
+    }
+
+
+# Карточка объекта в каждом канале: те же поля property_card, своя разметка;
+# строка с пустым полем пропускается
+
+def _text_card(n: int, c: dict) -> str:
+    lines = [f'{n}. {c["title"]}']
+    if c['type']:
+        lines.append(f'   Тип: {c["type"]}')
+    if c['address']:
+        lines.append(f'   Адрес: {c["address"]}')
+    if c['details']:
+        lines.append(f'   {c["details"]}')
+    if c['price']:
+        lines.append(f'   Цена: {c["price"]}')
+    if c['description']:
+        lines.append(f'   {c["description"]}')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _html_card(n: int, c: dict) -> str:
+    esc = html.escape
+    lines = [
+        '<div style="border:1px solid #e5e7eb;border-radius:8px;padding:16px;margin:12px 0;">',
+        f'<h3 style="margin:0 0 8px;color:#111827;">{n}. {esc(c["title"])}</h3>',
+    ]
+    if c['type']:
+        lines.append(f'<p style="margin:4px 0;color:#6b7280;font-size:14px;">Тип: {esc(c["type"])}</p>')
+    if c['address']:
+        lines.append(f'<p style="margin:4px 0;color:#374151;font-size:14px;">📍 {esc(c["address"])}</p>')
+    if c['details']:
+        lines.append(f'<p style="margin:4px 0;color:#374151;font-size:14px;">{esc(c["details"])}</p>')
+    if c['price']:
+        lines.append(f'<p style="margin:8px 0 0;font-size:18px;font-weight:bold;color:#059669;">{c["price"]}</p>')
+    if c['description']:
+        lines.append(f'<p style="margin:6px 0 0;color:#6b7280;font-size:13px;">{esc(c["description"])}</p>')
+    lines.append('</div>')
+    return '\n'.join(lines)
+
+
+def _telegram_card(n: int, c: dict) -> str:
+    esc = _escape_telegram
+    lines = [f'<b>{n}. {esc(c["title"])}</b>']
+    if c['type']:
+        lines.append(f'Тип: {esc(c["type"])}')
+    if c['address']:
+        lines.append(f'📍 {esc(c["address"])}')
+    if c['details']:
+        lines.append(esc(c['details']))
+    if c['price']:
+        lines.append(f'💰 {c["price"]}')
+    return '\n'.join(lines)
+
+
+def _escape_telegram(value: str) -> str:
+    '''Экранирует текст для parse_mode=HTML и обрезает до TELEGRAM_MAX_FIELD'''
+    return html.escape(value[:TELEGRAM_MAX_FIELD], quote=False)
@@ -2,8 +2,10 @@ import json
 import os
 import re
 import html
+import hashlib
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+import urllib.error
 import urllib.request
 import xml.etree.ElementTree as ET
 from datetime import datetime
@@ -180,16 +182,69 @@ def is_relevant(title, description, feed_config):
     return has_keyword
 
 
-def parse_feed(feed_config):
+def load_feed_cache(cur):
+    cur.execute(f"SELECT cache_key, etag, last_modified, body_hash FROM {SCHEMA}.feed_cache")
+    return {row['cache_key']: dict(row) for row in cur.fetchall()}
+
+
+def save_feed_cache(cur, feed_cache):
+    rows = [
+        (key, entry.get('etag'), entry.get('last_modified'), entry.get('body_hash'))
+        for key, entry in feed_cache.items() if entry.get('dirty')
+    ]
+    if not rows:
+        return
+    execute_values(cur, f"""
+        INSERT INTO {SCHEMA}.feed_cache (cache_key, etag, last_modified, body_hash)
+        VALUES %s
+        ON CONFLICT (cache_key) DO UPDATE SET
+            etag=EXCLUDED.etag, last_modified=EXCLUDED.last_modified,
+            body_hash=EXCLUDED.body_hash, checked_at=CURRENT_TIMESTAMP
+    """, rows, page_size=len(rows))
+
+
+def fetch_feed(url, feed_cache):
+    """Условный GET ленты. Возвращает тело или None, если лента не изменилась (304 или тот же хэш)"""
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (compatible; NewsBot/1.0)'})
+    cached = feed_cache.get(url)
+    if cached:
+        if cached.get('etag'):
+            req.add_header('If-None-Match', cached['etag'])
+        if cached.get('last_modified'):
+            req.add_header('If-Modified-Since', cached['last_modified'])
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            xml_data = response.read()
+            headers = response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            feed_cache[url] = {**cached, 'dirty': True}
+            return None
+        raise
+
+    body_hash = hashlib.sha256(xml_data).hexdigest()
+    feed_cache[url] = {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'body_hash': body_hash,
+        'dirty': True,
+    }
+    if cached and cached.get('body_hash') == body_hash:
+        return None
+    return xml_data
+
+
+def parse_feed(feed_config, feed_cache=None):
+    """Разбирает ленту. Возвращает None, если по данным feed_cache лента не изменилась"""
     articles = []
     url = feed_config['url']
     source = feed_config['source']
     category = feed_config['category']
 
     try:
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (compatible; NewsBot/1.0)'})
-        with urllib.request.urlopen(req, timeout=10) as response:
-            xml_data = response.read()
+        xml_data = fetch_feed(url, feed_cache if feed_cache is not None else {})
+        if xml_data is None:
+            return None
 
         root = ET.fromstring(xml_data)
         items = root.findall('.//item') or root.findall('.//{http://www.w3.org/2005/Atom}entry')
@@ -275,19 +330,27 @@ def handler(event, context):
         if method == 'POST':
             all_articles = []
             feed_errors = []
+            not_modified = 0
+            feed_cache = load_feed_cache(cur)
 
             for feed in RSS_FEEDS:
                 try:
-                    articles = parse_feed(feed)
-                    all_articles.extend(articles)
+                    articles = parse_feed(feed, feed_cache)
+                    if articles is None:
+                        not_modified += 1
+                        continue
+                    all_articles.extend((feed['url'], article) for article in articles)
                 except Exception as e:
                     feed_errors.append(f'{feed["source"]}: {str(e)}')
 
             inserted = 0
             skipped = 0
             errors = []
+            failed_feeds = set()
 
-            for article in all_articles:
+            for feed_url, article in all_articles:
+                # Точка сохранения на статью: ошибка одной вставки не обрывает транзакцию остальных
+                cur.execute('SAVEPOINT article')
                 try:
                     slug = slugify(article['title'])
                     cur.execute(f'SELECT id FROM {SCHEMA}.news WHERE slug = %s', (slug,))
@@ -317,13 +380,22 @@ def handler(event, context):
                     ))
                     inserted += 1
                 except Exception as e:
+                    cur.execute('ROLLBACK TO SAVEPOINT article')
+                    failed_feeds.add(feed_url)
                     errors.append(str(e)[:100])
+                finally:
+                    cur.execute('RELEASE SAVEPOINT article')
 
+            # Ленту с несохранёнными статьями не помечаем обработанной — иначе при том же хэше они не вернутся
+            for feed_url in failed_feeds:
+                feed_cache.get(feed_url, {}).pop('dirty', None)
+            save_feed_cache(cur, feed_cache)
             conn.commit()
 
             return respond(200, {
                 'success': True,
                 'parsed': len(all_articles),
+                'not_modified': not_modified,
                 'inserted': inserted,
                 'skipped': skipped,
                 'errors': errors[:5],
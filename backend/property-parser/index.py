@@ -1,11 +1,18 @@
+import base64
+import hashlib
 import json
 import os
 import re
+import urllib.error
+import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
 import html
+import math
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from concurrent.futures import ThreadPoolExecutor, wait
+from psycopg2.extras import Json, RealDictCursor, execute_values
 from datetime import datetime
 
 SCHEMA = 't_p26758318_mortgage_support_pro'
@@ -16,6 +23,50 @@ CORS = {
     'Access-Control-Allow-Headers': 'Content-Type',
 }
 
+# Таймаут одного HTTP-запроса к источнику и общий дедлайн на все источники сразу
+HTTP_TIMEOUT = 12
+FETCH_DEADLINE = 15
+FEED_HEAD_BYTES = 64 * 1024
+FEED_CHUNK_BYTES = 16 * 1024
+
+# Автомат отключения хоста (host_limits): порог ошибок подряд, пауза до пробного запроса, таймаут пробы
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN_SEC = 300
+CIRCUIT_PROBE_TIMEOUT_SEC = 60
+
+# Матрица прогрева кэша для action=refresh (города можно переопределить через REFRESH_CITIES)
+REFRESH_CITIES = [c.strip() for c in os.environ.get('REFRESH_CITIES', 'Севастополь,Симферополь').split(',') if c.strip()]
+REFRESH_TYPES = ['apartment', 'house', 'land', 'commercial']
+REFRESH_OPERATIONS = ['sale', 'rent']
+REFRESH_WORKERS = 4
+
+# Устаревание кэша объявлений (action=expire): сначала деактивация, затем перенос в архив пачками
+EXPIRE_AFTER_HOURS = 72
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_MAX_BATCHES = 20
+
+PAGE_SIZE = 50
+MAX_CLIENT_BATCH = 100
+MAX_PAGE_SIZE = 200
+
+# Допуски склейки дублей между площадками (dedupe_listings)
+DEDUP_PRICE_TOLERANCE = 0.02
+DEDUP_AREA_TOLERANCE = 0.02
+DEDUP_TEXT_SIMILARITY = 0.6
+
+# Границы ценовых корзин для фасетов (руб.)
+PRICE_BUCKETS = [3_000_000, 5_000_000, 8_000_000, 12_000_000]
+
+# Геокодирование адресов (geocode_cache) и поиск near=lat,lon&radius=км по geohash
+GEOCODER = os.environ.get('GEOCODER', 'yandex')
+GEOCODE_TIMEOUT = 5
+GEOCODE_MAX_PER_RUN = 40
+GEOHASH_PRECISION = 9
+NEAR_DEFAULT_RADIUS_KM = 2.0
+NEAR_MAX_RADIUS_KM = 50.0
+EARTH_RADIUS_KM = 6371.0
+
 def handler(event: dict, context) -> dict:
     """Парсер объявлений по недвижимости из открытых RSS-источников (Avito, ЦИАН, Яндекс и др.)"""
     method = event.get('httpMethod', 'GET')
@@ -27,14 +78,19 @@ def handler(event: dict, context) -> dict:
     action = params.get('action', 'search')
 
     if method == 'GET' and action == 'search':
-        city = params.get('city', 'Севастополь')
+        near = params.get('near', '').strip()
+        # С near= город по умолчанию не подставляется: радиус сам задаёт область поиска
+        city = params.get('city', '' if near else 'Севастополь')
         prop_type = params.get('type', '')
         operation = params.get('operation', 'sale')
-        min_price = params.get('min_price')
-        max_price = params.get('max_price')
-        rooms = params.get('rooms')
-
-        results = []
+        location_query = params.get('q', '').strip()
+        try:
+            min_price, max_price, rooms = (
+                int(params[key]) if params.get(key) else None for key in ('min_price', 'max_price', 'rooms')
+            )
+            limit = max(1, min(int(params.get('limit') or PAGE_SIZE), MAX_PAGE_SIZE))
+        except ValueError:
+            return _err(400, 'invalid min_price, max_price, rooms or limit')
 
         # 1. Ищем в кэше БД
         conn = psycopg2.connect(os.environ['DATABASE_URL'])
@@ -44,80 +100,115 @@ def handler(event: dict, context) -> dict:
         values = []
 
         if city:
-            conditions.append("LOWER(location) LIKE %s")
-            values.append(f'%{city.lower()}%')
+            conditions.append("city = %s")
+            values.append(_normalize_city(city))
+        if location_query:
+            # Свободный поиск по адресу обслуживает trigram-индекс idx_parsed_listings_location_trgm
+            conditions.append("location ILIKE %s")
+            values.append(f'%{location_query}%')
         if operation:
             conditions.append("operation = %s")
             values.append(operation)
         if prop_type:
             conditions.append("property_type = %s")
             values.append(prop_type)
-        if min_price:
+        if min_price is not None:
             conditions.append("price >= %s")
-            values.append(int(min_price))
-        if max_price:
+            values.append(min_price)
+        if max_price is not None:
             conditions.append("price <= %s")
-            values.append(int(max_price))
-        if rooms:
+            values.append(max_price)
+        if rooms is not None:
             conditions.append("rooms = %s")
-            values.append(int(rooms))
+            values.append(rooms)
+        if near:
+            try:
+                lat, lon = (float(v) for v in near.split(','))
+                radius = float(params.get('radius') or NEAR_DEFAULT_RADIUS_KM)
+            except ValueError:
+                conn.close()
+                return _err(400, 'near must be lat,lon and radius a number of km')
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180) or radius <= 0:
+                conn.close()
+                return _err(400, 'near must be lat,lon and radius a number of km')
+            radius = min(radius, NEAR_MAX_RADIUS_KM)
+            # Грубый отбор по префиксам geohash (idx_parsed_listings_geohash), точный — по расстоянию
+            cells = _geohash_cover(lat, lon, radius)
+            conditions.append('(' + ' OR '.join(['geohash LIKE %s'] * len(cells)) + ')')
+            values += [f'{cell}%' for cell in cells]
+            conditions.append(f"{_DISTANCE_SQL} <= %s")
+            values += [lat, lat, lon, radius]
 
         where = ' AND '.join(conditions)
-        cursor.execute(f"SELECT * FROM {SCHEMA}.parsed_listings WHERE {where} ORDER BY parsed_at DESC LIMIT 50", values)
+        page_cursor = params.get('cursor')
+
+        facets = None
+        if params.get('facets') == '1':
+            facets = fetch_facets(cursor, where, values)
+
+        page_conditions = list(conditions)
+        page_values = list(values)
+        if page_cursor:
+            try:
+                after_ts, after_id = _decode_cursor(page_cursor)
+            except ValueError:
+                conn.close()
+                return _err(400, 'invalid cursor')
+            page_conditions.append("(parsed_at, id) < (%s, %s)")
+            page_values += [after_ts, after_id]
+
+        cursor.execute(f"""
+            SELECT * FROM {SCHEMA}.parsed_listings
+            WHERE {' AND '.join(page_conditions)}
+            ORDER BY parsed_at DESC, id DESC
+            LIMIT %s
+        """, page_values + [limit + 1])
         cached = [dict(r) for r in cursor.fetchall()]
+        next_cursor = None
+        if len(cached) > limit:
+            cached = cached[:limit]
+            next_cursor = _encode_cursor(cached[-1]['parsed_at'], cached[-1]['id'])
 
-        if cached:
+        # Кэш прогревается кроном (action=refresh); живой парсинг — по явному live=1
+        # или для сочетаний вне матрицы прогрева (другой город, тип, операция), которые крон не заполнит
+        live = params.get('live') == '1' or (city and not _refresh_covers(city, prop_type, operation))
+        if cached or page_cursor or not live:
             conn.close()
-            return _ok({'listings': cached, 'source': 'cache', 'count': len(cached)})
+            result = {'listings': cached, 'source': 'cache', 'count': len(cached), 'next_cursor': next_cursor}
+            if facets is not None:
+                result['facets'] = facets
+            return _ok(result)
 
-        # 2. Парсим свежие данные
-        listings = []
-        listings += parse_avito_rss(city, prop_type, operation)
-        listings += parse_cian_rss(city, prop_type, operation)
-        listings += parse_domofond_rss(city, prop_type, operation)
+        # 2. Парсим свежие данные (все источники параллельно, с общим дедлайном)
+        guard_conn = _connect_guard()
+        listings, sources_stats = fetch_all_sources(
+            city, prop_type, operation, adapters=load_adapters(cursor), guard_conn=guard_conn,
+        )
+        guard_conn.close()
+        record_source_stats(cursor, sources_stats)
 
         # Фильтруем по цене и комнатам
-        if min_price:
-            listings = [l for l in listings if l.get('price') and l['price'] >= int(min_price)]
-        if max_price:
-            listings = [l for l in listings if l.get('price') and l['price'] <= int(max_price)]
-        if rooms:
-            listings = [l for l in listings if l.get('rooms') == int(rooms)]
-
-        # Сохраняем в кэш
-        for listing in listings:
-            try:
-                cursor.execute(f"""
-                    INSERT INTO {SCHEMA}.parsed_listings
-                        (external_id, source, title, price, location, area, rooms, floor, total_floors,
-                         property_type, operation, photo_url, url, description, phone)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (external_id, source) DO UPDATE SET
-                        title=EXCLUDED.title, price=EXCLUDED.price,
-                        parsed_at=CURRENT_TIMESTAMP, is_active=true
-                """, (
-                    listing.get('external_id', ''),
-                    listing.get('source', ''),
-                    listing.get('title', ''),
-                    listing.get('price'),
-                    listing.get('location', ''),
-                    listing.get('area'),
-                    listing.get('rooms'),
-                    listing.get('floor'),
-                    listing.get('total_floors'),
-                    listing.get('property_type', ''),
-                    listing.get('operation', 'sale'),
-                    listing.get('photo_url', ''),
-                    listing.get('url', ''),
-                    listing.get('description', ''),
-                    listing.get('phone', ''),
-                ))
-            except Exception as e:
-                print(f'DB save error: {e}')
-        conn.commit()
+        if min_price is not None:
+            listings = [l for l in listings if l.get('price') and l['price'] >= min_price]
+        if max_price is not None:
+            listings = [l for l in listings if l.get('price') and l['price'] <= max_price]
+        if rooms is not None:
+            listings = [l for l in listings if l.get('rooms') == rooms]
+
+        # Схлопываем одно и то же объявление с разных площадок и сохраняем в кэш одним запросом;
+        # координаты в живом поиске берутся только из geocode_cache, без запросов к геокодеру
+        listings, duplicates = dedupe_listings(listings)
+        geocode_listings(cursor, listings, max_requests=0)
+        saved = save_listings(cursor, listings)
         conn.close()
 
-        return _ok({'listings': listings[:50], 'source': 'live', 'count': len(listings)})
+        result = {
+            'listings': listings[:limit], 'source': 'live', 'count': len(listings), 'next_cursor': None,
+            'sources': sources_stats, 'saved': saved, 'duplicates': duplicates,
+        }
+        if facets is not None:
+            result['facets'] = facets
+        return _ok(result)
 
     if method == 'POST' and action == 'save_to_client':
         body = json.loads(event.get('body', '{}')) if event.get('body') else {}
@@ -129,34 +220,893 @@ def handler(event: dict, context) -> dict:
         conn = psycopg2.connect(os.environ['DATABASE_URL'])
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         cursor.execute(f"""
-            INSERT INTO {SCHEMA}.client_properties
-                (client_id, title, property_type, address, area, rooms, floor, total_floors, price, description, photo_url)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO {SCHEMA}.client_properties ({', '.join(CLIENT_PROPERTY_COLUMNS)})
+            VALUES ({', '.join(['%s'] * len(CLIENT_PROPERTY_COLUMNS))})
             RETURNING *
-        """, (
-            client_id,
-            listing.get('title', ''),
-            listing.get('property_type', ''),
+        """, _client_property_row(client_id, listing))
+        prop = dict(cursor.fetchone())
+        conn.commit()
+        conn.close()
+        return _ok({'success': True, 'property': prop})
+
+    if method == 'POST' and action == 'save_to_client_batch':
+        body = json.loads(event.get('body', '{}')) if event.get('body') else {}
+        client_id = body.get('client_id')
+        listings = body.get('listings') or []
+        if not client_id or not listings:
+            return _err(400, 'client_id and listings are required')
+        if len(listings) > MAX_CLIENT_BATCH:
+            return _err(400, f'no more than {MAX_CLIENT_BATCH} listings per request')
+
+        # Внутри пачки одна ссылка — один объект; объявления без ссылки сохраняем как есть
+        rows = []
+        seen_urls = set()
+        for listing in listings:
+            url = listing.get('url') or ''
+            if url and url in seen_urls:
+                continue
+            seen_urls.add(url)
+            rows.append(_client_property_row(client_id, listing))
+
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            created = execute_values(cursor, f"""
+                INSERT INTO {SCHEMA}.client_properties ({', '.join(CLIENT_PROPERTY_COLUMNS)})
+                SELECT v.* FROM (VALUES %s) AS v ({', '.join(CLIENT_PROPERTY_COLUMNS)})
+                WHERE v.source_url = '' OR NOT EXISTS (
+                    SELECT 1 FROM {SCHEMA}.client_properties cp
+                    WHERE cp.client_id = v.client_id AND cp.source_url = v.source_url
+                )
+                RETURNING *
+            """, rows, template=CLIENT_PROPERTY_TEMPLATE, page_size=len(rows), fetch=True)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        created = [dict(r) for r in created]
+        return _ok({
+            'success': True, 'properties': created,
+            'created': len(created), 'skipped': len(listings) - len(created),
+        })
+
+    if action == 'refresh' and method in ('GET', 'POST'):
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            run = refresh_cache(cursor)
+        finally:
+            conn.close()
+        return _ok({'success': True, **run})
+
+    if method == 'GET' and action == 'price_history':
+        city = _normalize_city(params.get('city', 'Севастополь'))
+        try:
+            days = max(1, min(int(params.get('days') or 30), 365))
+        except ValueError:
+            return _err(400, 'invalid days')
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"""
+            SELECT day, operation, property_type, changes, drops, rises, avg_drop_pct, max_drop_pct
+            FROM {SCHEMA}.listing_price_daily
+            WHERE city = %s AND day >= CURRENT_DATE - %s
+            ORDER BY day DESC
+        """, (city, days))
+        daily = [dict(r) for r in cursor.fetchall()]
+        cursor.execute(f"""
+            SELECT h.listing_id, h.old_price, h.new_price, h.changed_at,
+                   ROUND((h.old_price - h.new_price) * 100.0 / h.old_price, 2) AS drop_pct,
+                   p.title, p.url, p.source, p.rooms, p.area
+            FROM {SCHEMA}.listing_price_history h
+            JOIN {SCHEMA}.parsed_listings p ON p.id = h.listing_id
+            WHERE h.city = %s AND h.new_price < h.old_price AND h.changed_at >= CURRENT_DATE - %s
+            ORDER BY h.changed_at DESC
+            LIMIT 50
+        """, (city, days))
+        drops = [dict(r) for r in cursor.fetchall()]
+        conn.close()
+        return _ok({'city': city, 'daily': daily, 'drops': drops})
+
+    if method == 'GET' and action == 'sources':
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"""
+            SELECT name, enabled, timeout_sec, rate_per_minute, runs, errors, items, total_ms,
+                   ROUND(errors::numeric / NULLIF(runs, 0), 3) AS error_rate,
+                   ROUND(items * 1000.0 / NULLIF(total_ms, 0), 1) AS items_per_sec,
+                   last_error, last_run_at
+            FROM {SCHEMA}.parser_sources
+        """)
+        rows = {r['name']: dict(r) for r in cursor.fetchall()}
+        conn.close()
+        sources = [
+            rows.get(a['name']) or {
+                'name': a['name'], 'enabled': True, 'timeout_sec': None, 'rate_per_minute': None, 'runs': 0,
+            }
+            for a in SOURCE_ADAPTERS
+        ]
+        return _ok({'sources': sources})
+
+    if method == 'POST' and action == 'update_source':
+        body = json.loads(event.get('body', '{}')) if event.get('body') else {}
+        name = body.get('name')
+        if name not in SOURCE_PREFIXES:
+            return _err(400, 'unknown source')
+        # Меняются только переданные поля: {"name": ..., "timeout_sec": 5} не включает выключенный источник.
+        # null в timeout_sec/rate_per_minute возвращает значение из кода
+        fields = {key: body[key] for key in ('enabled', 'timeout_sec', 'rate_per_minute') if key in body}
+        if 'enabled' in fields and not isinstance(fields['enabled'], bool):
+            return _err(400, 'enabled must be true or false')
+        for key, minimum in (('timeout_sec', 1), ('rate_per_minute', 0)):
+            value = fields.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < minimum):
+                return _err(400, f'{key} must be an integer >= {minimum} or null')
+        if not fields:
+            return _err(400, 'nothing to update')
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"""
+            INSERT INTO {SCHEMA}.parser_sources (name, {', '.join(fields)})
+            VALUES (%s, {', '.join(['%s'] * len(fields))})
+            ON CONFLICT (name) DO UPDATE SET {', '.join(f'{key}=EXCLUDED.{key}' for key in fields)}
+            RETURNING *
+        """, [name] + list(fields.values()))
+        source = dict(cursor.fetchone())
+        conn.commit()
+        conn.close()
+        return _ok({'success': True, 'source': source})
+
+    if action == 'expire' and method in ('GET', 'POST'):
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            result = expire_listings(cursor)
+        finally:
+            conn.close()
+        return _ok({'success': True, **result})
+
+    if method == 'POST' and action == 'backfill_ids':
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            result = backfill_listing_ids(cursor)
+        finally:
+            conn.close()
+        return _ok({'success': True, **result})
+
+    return _err(405, 'Method not allowed')
+
+
+def fetch_facets(cursor, where: str, values: list) -> dict:
+    """Счётчики по комнатам, ценовым корзинам и источникам одним GROUPING SETS запросом"""
+    bucket_cases = ' '.join(f'WHEN price < {edge} THEN {i}' for i, edge in enumerate(PRICE_BUCKETS))
+    cursor.execute(f"""
+        SELECT rooms, price_bucket, source,
+               GROUPING(rooms) AS g_rooms, GROUPING(price_bucket) AS g_price, GROUPING(source) AS g_source,
+               COUNT(*) AS cnt
+        FROM (
+            SELECT rooms, source,
+                   CASE WHEN price IS NULL THEN NULL {bucket_cases} ELSE {len(PRICE_BUCKETS)} END AS price_bucket
+            FROM {SCHEMA}.parsed_listings
+            WHERE {where}
+        ) f
+        GROUP BY GROUPING SETS ((rooms), (price_bucket), (source), ())
+    """, values)
+
+    facets = {'total': 0, 'rooms': [], 'price': [], 'source': []}
+    for row in cursor.fetchall():
+        if row['g_rooms'] and row['g_price'] and row['g_source']:
+            facets['total'] = row['cnt']
+        elif not row['g_rooms']:
+            facets['rooms'].append({'rooms': row['rooms'], 'count': row['cnt']})
+        elif not row['g_price']:
+            facets['price'].append({**_price_bucket_range(row['price_bucket']), 'count': row['cnt']})
+        else:
+            facets['source'].append({'source': row['source'], 'count': row['cnt']})
+    return facets
+
+
+def _price_bucket_range(bucket: int | None) -> dict:
+    if bucket is None:
+        return {'min': None, 'max': None}
+    edges = [0] + PRICE_BUCKETS + [None]
+    return {'min': edges[bucket], 'max': edges[bucket + 1]}
+
+
+def _encode_cursor(parsed_at: datetime, listing_id: int) -> str:
+    raw = f'{parsed_at.isoformat()}|{listing_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(value: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        ts, listing_id = raw.split('|', 1)
+        return datetime.fromisoformat(ts), int(listing_id)
+    except Exception as e:
+        raise ValueError(f'bad cursor: {value}') from e
+
+
+CLIENT_PROPERTY_COLUMNS = (
+    'client_id', 'title', 'property_type', 'address', 'area', 'rooms', 'floor', 'total_floors',
+    'price', 'description', 'photo_url', 'source_url',
+)
+
+CLIENT_PROPERTY_TEMPLATE = '(' + ', '.join(f'%s::{t}' for t in (
+    'integer', 'varchar', 'varchar', 'text', 'numeric', 'integer', 'integer', 'integer',
+    'numeric', 'text', 'text', 'text',
+)) + ')'
+
+
+def _client_property_row(client_id, listing: dict) -> tuple:
+    url = listing.get('url') or ''
+    return (
+        client_id,
+        (listing.get('title') or 'Объект недвижимости')[:255],
+        listing.get('property_type', ''),
+        listing.get('location', ''),
+        listing.get('area'),
+        listing.get('rooms'),
+        listing.get('floor'),
+        listing.get('total_floors'),
+        listing.get('price'),
+        (listing.get('description', '') or '') + ('\n\nИсточник: ' + url if url else ''),
+        listing.get('photo_url', ''),
+        url,
+    )
+
+
+def _refresh_covers(city: str, prop_type: str, operation: str) -> bool:
+    return (
+        _normalize_city(city) in {_normalize_city(c) for c in REFRESH_CITIES}
+        and (not prop_type or prop_type in REFRESH_TYPES)
+        and operation in REFRESH_OPERATIONS
+    )
+
+
+def refresh_cache(cursor) -> dict:
+    """Прогревает кэш parsed_listings по матрице город × тип × операция и пишет итоги запуска"""
+    started = time.monotonic()
+    combos = [
+        (city, prop_type, operation)
+        for city in REFRESH_CITIES
+        for prop_type in REFRESH_TYPES
+        for operation in REFRESH_OPERATIONS
+    ]
+
+    feed_cache = load_feed_cache(cursor)
+    adapters = load_adapters(cursor)
+    listings = []
+    unchanged = []
+    all_stats = []
+    timeouts = 0
+    guard_conn = _connect_guard()
+    with ThreadPoolExecutor(max_workers=REFRESH_WORKERS) as pool:
+        results = pool.map(
+            lambda c: fetch_all_sources(*c, feed_cache=feed_cache, adapters=adapters, guard_conn=guard_conn),
+            combos,
+        )
+        for (city, prop_type, operation), (items, stats) in zip(combos, results):
+            listings += items
+            all_stats += stats
+            timeouts += sum(1 for st in stats if st['timed_out'])
+            unchanged += [
+                (st['source'], _normalize_city(city), operation, prop_type or 'apartment')
+                for st in stats if st['not_modified']
+            ]
+    guard_conn.close()
+
+    fetched = len(listings)
+    listings, duplicates = dedupe_listings(listings)
+    geocoded = geocode_listings(cursor, listings)
+    saved = save_listings(cursor, listings)
+    touched = touch_listings(cursor, unchanged)
+    record_source_stats(cursor, all_stats)
+    rollup_price_history(cursor)
+    save_feed_cache(cursor, feed_cache)
+    duration_ms = int((time.monotonic() - started) * 1000)
+
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.parser_refresh_runs
+            (duration_ms, combinations, fetched, inserted, updated, rejected, source_timeouts, feeds_not_modified)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    """, (
+        duration_ms, len(combos), fetched, saved['inserted'], saved['updated'], saved['rejected'],
+        timeouts, len(unchanged),
+    ))
+    run_id = cursor.fetchone()['id']
+    cursor.connection.commit()
+
+    return {
+        'run_id': run_id, 'duration_ms': duration_ms, 'combinations': len(combos),
+        'fetched': fetched, 'duplicates': duplicates, 'source_timeouts': timeouts,
+        'feeds_not_modified': len(unchanged), 'touched': touched, 'geocoding': geocoded, **saved,
+    }
+
+
+def rollup_price_history(cursor) -> None:
+    """Пересчитывает дневную сводку изменений цен за вчера и сегодня (поздние изменения тоже попадают)"""
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.listing_price_daily
+            (day, city, operation, property_type, changes, drops, rises, avg_drop_pct, max_drop_pct)
+        SELECT changed_at::date, COALESCE(city, ''), COALESCE(operation, ''), COALESCE(property_type, ''),
+               COUNT(*),
+               COUNT(*) FILTER (WHERE new_price < old_price),
+               COUNT(*) FILTER (WHERE new_price > old_price),
+               ROUND(AVG((old_price - new_price) * 100.0 / old_price) FILTER (WHERE new_price < old_price), 2),
+               ROUND(MAX((old_price - new_price) * 100.0 / old_price) FILTER (WHERE new_price < old_price), 2)
+        FROM {SCHEMA}.listing_price_history
+        WHERE changed_at >= CURRENT_DATE - 1
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (day, city, operation, property_type) DO UPDATE SET
+            changes=EXCLUDED.changes, drops=EXCLUDED.drops, rises=EXCLUDED.rises,
+            avg_drop_pct=EXCLUDED.avg_drop_pct, max_drop_pct=EXCLUDED.max_drop_pct
+    """)
+    cursor.connection.commit()
+
+
+def touch_listings(cursor, keys: list) -> int:
+    """Продлевает свежесть объявлений источников, чьи ленты не изменились с прошлого прогрева"""
+    if not keys:
+        return 0
+    execute_values(cursor, f"""
+        UPDATE {SCHEMA}.parsed_listings p SET parsed_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS k(source, city, operation, property_type)
+        WHERE p.source = k.source AND p.city = k.city
+          AND p.operation = k.operation AND p.property_type = k.property_type
+          AND p.is_active = true
+    """, keys, page_size=len(keys))
+    touched = cursor.rowcount
+    cursor.connection.commit()
+    return touched
+
+
+def expire_listings(cursor) -> dict:
+    """Деактивирует объявления, не обновлявшиеся EXPIRE_AFTER_HOURS, и переносит давно
+    неактивные в parsed_listings_archive, чтобы горячая таблица и её индексы не росли бесконечно"""
+    started = time.monotonic()
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.parsed_listings SET is_active = false
+        WHERE is_active = true AND parsed_at < NOW() - make_interval(hours => %s)
+    """, (EXPIRE_AFTER_HOURS,))
+    deactivated = cursor.rowcount
+    cursor.connection.commit()
+
+    columns = ', '.join(('id', 'parsed_at', 'is_active') + LISTING_COLUMNS)
+    archived = 0
+    for _ in range(ARCHIVE_MAX_BATCHES):
+        # Пачками по ARCHIVE_BATCH_SIZE, чтобы не держать длинные блокировки
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {SCHEMA}.parsed_listings
+                WHERE id IN (
+                    SELECT id FROM {SCHEMA}.parsed_listings
+                    WHERE is_active = false AND parsed_at < NOW() - make_interval(days => %s)
+                    LIMIT %s
+                )
+                RETURNING {columns}
+            )
+            INSERT INTO {SCHEMA}.parsed_listings_archive ({columns})
+            SELECT {columns} FROM moved
+        """, (ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE))
+        batch = cursor.rowcount
+        cursor.connection.commit()
+        archived += batch
+        if batch < ARCHIVE_BATCH_SIZE:
+            break
+
+    return {
+        'deactivated': deactivated, 'archived': archived,
+        'duration_ms': int((time.monotonic() - started) * 1000),
+    }
+
+
+LISTING_COLUMNS = (
+    'external_id', 'source', 'title', 'price', 'location', 'city', 'area', 'rooms', 'floor', 'total_floors',
+    'property_type', 'operation', 'photo_url', 'url', 'description', 'phone', 'alt_sources',
+    'lat', 'lon', 'geohash',
+)
+
+# Типы колонок для VALUES внутри CTE: там Postgres не выводит их из целевой таблицы
+LISTING_TEMPLATE = '(' + ', '.join(f'%s::{t}' for t in (
+    'varchar', 'varchar', 'text', 'bigint', 'text', 'varchar', 'numeric', 'integer', 'integer', 'integer',
+    'varchar', 'varchar', 'text', 'text', 'text', 'varchar', 'jsonb',
+    'double precision', 'double precision', 'varchar',
+)) + ')'
+
+
+def dedupe_listings(listings: list) -> tuple[list, int]:
+    """Схлопывает одно и то же объявление с разных площадок в одну запись со списком alt_sources.
+    Кандидаты ищутся только внутри блока (город, операция, тип, комнаты, корзина площади/цены)
+    и соседних корзин, поэтому сравнений O(n), а не O(n²). Корзины логарифмические шириной
+    в допуск сравнения: совпадающие в пределах допуска значения всегда в той же или соседней корзине."""
+    kept = []
+    blocks = {}
+    duplicates = 0
+    for listing in listings:
+        key = _block_key(listing)
+        if key is None:
+            kept.append(listing)
+            continue
+        base, bucket = key
+        match = None
+        for neighbour in (bucket - 1, bucket, bucket + 1):
+            for candidate in blocks.get((base, neighbour), ()):
+                if candidate['source'] != listing['source'] and _same_listing(candidate, listing):
+                    match = candidate
+                    break
+            if match:
+                break
+        if match is None:
+            blocks.setdefault(key, []).append(listing)
+            kept.append(listing)
+            continue
+        duplicates += 1
+        match.setdefault('alt_sources', []).append({'source': listing['source'], 'url': listing.get('url', '')})
+        for field in ('price', 'area', 'rooms', 'floor', 'total_floors', 'photo_url', 'description'):
+            if not match.get(field) and listing.get(field):
+                match[field] = listing[field]
+    return kept, duplicates
+
+
+def _block_key(listing: dict) -> tuple | None:
+    base = (listing.get('city'), listing.get('operation'), listing.get('property_type'), listing.get('rooms'))
+    for field, tolerance in (('area', DEDUP_AREA_TOLERANCE), ('price', DEDUP_PRICE_TOLERANCE)):
+        value = float(listing.get(field) or 0)
+        if value > 0:
+            # |x - y| <= tol·max(x, y)  =>  |ln x - ln y| <= -ln(1 - tol), т.е. не больше одной корзины
+            return (field,) + base, math.floor(math.log(value) / -math.log(1 - tolerance))
+    return None
+
+
+def _same_listing(a: dict, b: dict) -> bool:
+    """Цена и площадь совпадают в пределах допуска, этаж не противоречит; если сравнить
+    цену или площадь нельзя, решает похожесть заголовка и адреса"""
+    comparable = 0
+    for field, tolerance in (('price', DEDUP_PRICE_TOLERANCE), ('area', DEDUP_AREA_TOLERANCE)):
+        x, y = a.get(field), b.get(field)
+        if x and y:
+            if abs(float(x) - float(y)) > tolerance * max(float(x), float(y)):
+                return False
+            comparable += 1
+    if a.get('floor') and b.get('floor') and a['floor'] != b['floor']:
+        return False
+    if comparable == 2:
+        return True
+    return _text_similarity(a, b) >= DEDUP_TEXT_SIMILARITY
+
+
+def _text_similarity(a: dict, b: dict) -> float:
+    ta = set(WORD_RE.findall(f"{a.get('title', '')} {a.get('location', '')}".lower()))
+    tb = set(WORD_RE.findall(f"{b.get('title', '')} {b.get('location', '')}".lower()))
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+def save_listings(cursor, listings: list) -> dict:
+    """Сохраняет результат парсинга в parsed_listings одним multi-row upsert"""
+    rows = {}
+    rejected = 0
+    for listing in listings:
+        key = (listing.get('external_id'), listing.get('source'))
+        if not key[0] or not key[1] or not listing.get('title'):
+            rejected += 1
+            continue
+        if key in rows:
+            # ON CONFLICT не может обновить одну строку дважды в одном запросе
+            rejected += 1
+            continue
+        rows[key] = (
+            listing['external_id'],
+            listing['source'],
+            listing['title'],
+            listing.get('price'),
             listing.get('location', ''),
+            listing.get('city') or None,
             listing.get('area'),
             listing.get('rooms'),
             listing.get('floor'),
             listing.get('total_floors'),
-            listing.get('price'),
-            (listing.get('description', '') or '') + ('\n\nИсточник: ' + listing.get('url', '') if listing.get('url') else ''),
+            listing.get('property_type', ''),
+            listing.get('operation', 'sale'),
             listing.get('photo_url', ''),
-        ))
-        prop = dict(cursor.fetchone())
-        conn.commit()
-        conn.close()
-        return _ok({'success': True, 'property': prop})
+            listing.get('url', ''),
+            listing.get('description', ''),
+            listing.get('phone', ''),
+            Json(listing.get('alt_sources', [])),
+            listing.get('lat'),
+            listing.get('lon'),
+            listing.get('geohash'),
+        )
+
+    stats = {'inserted': 0, 'updated': 0, 'rejected': rejected}
+    if not rows:
+        return stats
+
+    try:
+        # Один запрос: старые цены читаются из того же снимка, что и upsert,
+        # поэтому изменения цены попадают в listing_price_history set-based, без построчных запросов
+        result = execute_values(cursor, f"""
+            WITH incoming ({', '.join(LISTING_COLUMNS)}) AS (VALUES %s),
+            previous AS (
+                SELECT p.id, p.price
+                FROM {SCHEMA}.parsed_listings p
+                JOIN incoming i ON i.external_id = p.external_id AND i.source = p.source
+            ),
+            upserted AS (
+                INSERT INTO {SCHEMA}.parsed_listings AS pl ({', '.join(LISTING_COLUMNS)})
+                SELECT * FROM incoming
+                ON CONFLICT (external_id, source) DO UPDATE SET
+                    title=EXCLUDED.title, price=EXCLUDED.price, city=EXCLUDED.city,
+                    alt_sources=EXCLUDED.alt_sources, parsed_at=CURRENT_TIMESTAMP, is_active=true,
+                    lat=COALESCE(EXCLUDED.lat, pl.lat), lon=COALESCE(EXCLUDED.lon, pl.lon),
+                    geohash=COALESCE(EXCLUDED.geohash, pl.geohash)
+                RETURNING id, price, city, operation, property_type, (xmax = 0) AS inserted
+            ),
+            history AS (
+                INSERT INTO {SCHEMA}.listing_price_history
+                    (listing_id, city, operation, property_type, old_price, new_price)
+                SELECT u.id, u.city, u.operation, u.property_type, prev.price, u.price
+                FROM upserted u
+                JOIN previous prev ON prev.id = u.id
+                WHERE prev.price IS NOT NULL AND u.price IS NOT NULL AND prev.price <> u.price
+            )
+            SELECT inserted FROM upserted
+        """, list(rows.values()), template=LISTING_TEMPLATE, page_size=len(rows), fetch=True)
+        cursor.connection.commit()
+    except Exception as e:
+        cursor.connection.rollback()
+        print(f'DB bulk save error: {e}')
+        stats['rejected'] += len(rows)
+        return stats
+
+    for row in result:
+        stats['inserted' if row['inserted'] else 'updated'] += 1
+    return stats
+
+
+def geocode_listings(cursor, listings: list, max_requests: int = GEOCODE_MAX_PER_RUN) -> dict:
+    """Проставляет объявлениям lat/lon/geohash: сначала из geocode_cache одним запросом,
+    промахи — через геокодер GEOCODER (не больше max_requests за вызов). Ненайденные адреса
+    тоже кэшируются (с пустыми координатами), сетевые ошибки — нет."""
+    addresses = {}
+    for listing in listings:
+        address = _listing_address(listing)
+        if address:
+            addresses.setdefault(_address_key(address), (address, []))[1].append(listing)
+    stats = {'addresses': len(addresses), 'cache_hits': 0, 'geocoded': 0, 'located': 0}
+    if not addresses:
+        return stats
+
+    cursor.execute(f"""
+        SELECT address_key, lat, lon FROM {SCHEMA}.geocode_cache WHERE address_key = ANY(%s)
+    """, (list(addresses),))
+    points = {r['address_key']: (r['lat'], r['lon']) for r in cursor.fetchall()}
+    stats['cache_hits'] = len(points)
+
+    geocode = GEOCODERS.get(GEOCODER)
+    misses = [key for key in addresses if key not in points][:max_requests] if geocode else []
+    if misses:
+        with ThreadPoolExecutor(max_workers=REFRESH_WORKERS) as pool:
+            results = pool.map(lambda key: _safe_geocode(geocode, addresses[key][0]), misses)
+            found = [(key, point) for key, point in zip(misses, results) if point is not False]
+        if found:
+            execute_values(cursor, f"""
+                INSERT INTO {SCHEMA}.geocode_cache (address_key, address, lat, lon, provider)
+                VALUES %s
+                ON CONFLICT (address_key) DO NOTHING
+            """, [(key, addresses[key][0], *(point or (None, None)), GEOCODER) for key, point in found],
+                page_size=len(found))
+            cursor.connection.commit()
+        for key, point in found:
+            points[key] = point or (None, None)
+        stats['geocoded'] = len(found)
+
+    for key, (_, items) in addresses.items():
+        lat, lon = points.get(key, (None, None))
+        if lat is None or lon is None:
+            continue
+        for listing in items:
+            listing['lat'], listing['lon'] = lat, lon
+            listing['geohash'] = _geohash(lat, lon)
+            stats['located'] += 1
+    return stats
+
+
+def _listing_address(listing: dict) -> str:
+    """Адрес для геокодера; объявления, где вместо адреса только город, не геокодируются:
+    точка центра города не даёт ничего поиску в радиусе"""
+    location = SPACE_RE.sub(' ', listing.get('location') or '').strip()
+    city = listing.get('city') or ''
+    if not location or _normalize_city(location) == city:
+        return ''
+    if city and city not in _normalize_city(location):
+        return f'{city.capitalize()}, {location}'
+    return location
+
+
+def _address_key(address: str) -> str:
+    return SPACE_RE.sub(' ', _normalize_city(address).replace(',', ' ')).strip()[:500]
+
+
+def _safe_geocode(geocode, address: str):
+    """(lat, lon), None если адрес не найден, False при сетевой ошибке (такой промах не кэшируется)"""
+    try:
+        return geocode(address)
+    except Exception as e:
+        print(f'Geocoder error for {address!r}: {e}')
+        return False
+
+
+def _geocode_yandex(address: str) -> tuple[float, float] | None:
+    api_key = os.environ.get('YANDEX_GEOCODER_KEY')
+    if not api_key:
+        raise RuntimeError('YANDEX_GEOCODER_KEY is not set')
+    query = urllib.parse.urlencode({'apikey': api_key, 'geocode': address, 'format': 'json', 'results': 1})
+    req = urllib.request.Request(f'https://geocode-maps.yandex.ru/1.x/?{query}', headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=GEOCODE_TIMEOUT) as resp:
+        data = json.loads(resp.read().decode('utf-8'))
+    members = data.get('response', {}).get('GeoObjectCollection', {}).get('featureMember', [])
+    if not members:
+        return None
+    lon, lat = members[0]['GeoObject']['Point']['pos'].split()
+    return float(lat), float(lon)
+
+
+# Центры городов для локального геокодера-заглушки (GEOCODER=stub) — тесты и стенды без ключа API
+STUB_CITY_CENTERS = {
+    'севастополь': (44.6167, 33.5254),
+    'симферополь': (44.9521, 34.1024),
+    'ялта': (44.4952, 34.1663),
+}
+
+
+def _geocode_stub(address: str) -> tuple[float, float] | None:
+    """Детерминированная точка в пределах ~3 км от центра города из адреса"""
+    key = _address_key(address)
+    for city, (lat, lon) in STUB_CITY_CENTERS.items():
+        if city in key:
+            digest = hashlib.sha1(key.encode('utf-8')).digest()
+            return lat + (digest[0] - 128) / 128 * 0.027, lon + (digest[1] - 128) / 128 * 0.038
+    return None
+
+
+GEOCODERS = {'yandex': _geocode_yandex, 'stub': _geocode_stub}
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Расстояние по гаверсинусу от точки (lat, lat, lon) до объявления, км
+_DISTANCE_SQL = (
+    f'{EARTH_RADIUS_KM} * 2 * ASIN(SQRT('
+    'POWER(SIN(RADIANS(lat - %s) / 2), 2) + '
+    'COS(RADIANS(%s)) * COS(RADIANS(lat)) * POWER(SIN(RADIANS(lon - %s) / 2), 2)))'
+)
 
-    return _err(405, 'Method not allowed')
 
+def _geohash(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits *= 2
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+
+def _geohash_cover(lat: float, lon: float, radius_km: float) -> list[str]:
+    """Префиксы geohash, покрывающие квадрат со стороной 2·radius вокруг точки.
+    Берётся самая длинная точность, у которой ячейка не меньше радиуса, — тогда ячеек не больше 3×3."""
+    dlat = radius_km / 111.32
+    dlon = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    precision = 1
+    for p in range(GEOHASH_PRECISION, 0, -1):
+        if 180 / 2 ** (5 * p // 2) >= dlat and 360 / 2 ** ((5 * p + 1) // 2) >= dlon:
+            precision = p
+            break
+    cell_lat = 180 / 2 ** (5 * precision // 2)
+    cell_lon = 360 / 2 ** ((5 * precision + 1) // 2)
+    lats = [lat - dlat + i * cell_lat for i in range(math.ceil(2 * dlat / cell_lat))] + [lat + dlat]
+    lons = [lon - dlon + i * cell_lon for i in range(math.ceil(2 * dlon / cell_lon))] + [lon + dlon]
+    return sorted({
+        _geohash(max(-90.0, min(90.0, la)), max(-180.0, min(180.0, lo)), precision)
+        for la in lats for lo in lons
+    })
+
+
+def fetch_all_sources(city: str, prop_type: str, operation: str, deadline: float = FETCH_DEADLINE,
+                      feed_cache: dict | None = None, adapters: list | None = None,
+                      guard_conn=None) -> tuple[list, list]:
+    """Запускает включённые адаптеры источников параллельно и возвращает то, что успело прийти до дедлайна.
+    С feed_cache ленты запрашиваются условным GET, а неизменившиеся источники помечаются not_modified.
+    С guard_conn запросы проходят через лимитер и автомат отключения хостов (host_limits)."""
+    adapters = SOURCE_ADAPTERS if adapters is None else adapters
+    if not adapters:
+        return [], []
+    pool = ThreadPoolExecutor(max_workers=len(adapters))
+    # Каждый источник пишет в свою копию кэша: валидаторы опоздавших и упавших источников не сохраняем
+    source_caches = {a['name']: dict(feed_cache) if feed_cache is not None else None for a in adapters}
+    futures = {
+        pool.submit(
+            _timed_parse, adapter, city, prop_type, operation, source_caches[adapter['name']], guard_conn
+        ): adapter['name']
+        for adapter in adapters
+    }
+    done, _ = wait(futures, timeout=deadline)
+    # Не ждём зависшие источники: их потоки завершатся сами по таймауту urlopen
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    listings = []
+    stats = []
+    for future, name in futures.items():
+        if future in done:
+            items, elapsed, not_modified, error = future.result()
+            listings += items
+            stats.append({
+                'source': name, 'count': len(items), 'latency_ms': elapsed,
+                'timed_out': False, 'not_modified': not_modified, 'error': error,
+            })
+            if feed_cache is not None and not error:
+                feed_cache.update({k: v for k, v in source_caches[name].items() if v.get('dirty')})
+        else:
+            stats.append({
+                'source': name, 'count': 0, 'latency_ms': int(deadline * 1000),
+                'timed_out': True, 'not_modified': False, 'error': 'timeout',
+            })
+    return listings, stats
+
+
+def _timed_parse(adapter: dict, city: str, prop_type: str, operation: str,
+                 feed_cache: dict | None, guard_conn=None) -> tuple[list, int, bool, str | None]:
+    started = time.monotonic()
+    items, not_modified, error = [], False, None
+    try:
+        items = parse_source(adapter, city, prop_type, operation, feed_cache, guard_conn)
+    except FeedNotModified:
+        not_modified = True
+    except Exception as e:
+        error = str(e)[:200]
+        print(f'{adapter["name"]} feed error: {e}')
+    return items, int((time.monotonic() - started) * 1000), not_modified, error
+
+
+def parse_source(adapter: dict, city: str, prop_type: str, operation: str,
+                 feed_cache: dict | None = None, guard_conn=None) -> list:
+    """Общий движок разбора ленты: URL, теги, разбор элемента и лимиты берутся из адаптера"""
+    url = adapter['build_url'](city, prop_type, operation)
+    host = urllib.parse.urlsplit(url).netloc
+    if guard_conn is not None:
+        _acquire_host(guard_conn, host, adapter)
 
-def parse_avito_rss(city: str, prop_type: str, operation: str) -> list:
-    """Парсит RSS-ленту Авито по недвижимости"""
     results = []
+    try:
+        req = urllib.request.Request(url, headers=adapter['headers'])
+        chunks = _feed_chunks(req, feed_cache, f'{url}#{city}|{prop_type}|{operation}', adapter['timeout'])
+        # scan_limit ограничивает прочитанные элементы, limit — подошедшие: ленты, где parse_item
+        # отсеивает чужие города, иначе дочитывались бы целиком и не укладывались в дедлайн
+        for scanned, item in enumerate(_iter_feed(chunks, adapter['item_tags']), 1):
+            if scanned > adapter['scan_limit']:
+                break
+            try:
+                listing = adapter['parse_item'](item, city, prop_type, operation)
+            except ValueError as e:
+                print(f'{adapter["name"]} item skipped: {e}')
+                continue
+            if listing:
+                results.append(listing)
+            if len(results) >= adapter['limit']:
+                break
+    except FeedNotModified:
+        _report_host(guard_conn, host, True)
+        raise
+    except Exception:
+        _report_host(guard_conn, host, False)
+        raise
+    _report_host(guard_conn, host, True)
+    return results
+
+
+class HostUnavailable(Exception):
+    """Хост отключён автоматом (circuit open) или исчерпал лимит запросов"""
+
+
+def _acquire_host(guard_conn, host: str, adapter: dict) -> None:
+    """Берёт токен из корзины хоста в host_limits. Открытый автомат отказывает сразу;
+    по истечении CIRCUIT_COOLDOWN_SEC пропускается один пробный запрос (half_open).
+    Состояние в Postgres, поэтому переживает холодные старты функции."""
+    rate = adapter.get('rate_per_minute') or 0
+    refill = rate / 60.0 if rate else 1000.0
+    deadline = time.monotonic() + adapter['timeout']
+    while True:
+        with guard_conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {SCHEMA}.host_limits (host, tokens, capacity, refill_per_sec)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (host) DO UPDATE SET capacity=EXCLUDED.capacity, refill_per_sec=EXCLUDED.refill_per_sec
+            """, (host, adapter['burst'], adapter['burst'], refill))
+            cur.execute(f"""
+                WITH cur AS (
+                    SELECT host, state, opened_at, probe_started_at, refill_per_sec,
+                           LEAST(capacity, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * refill_per_sec) AS avail
+                    FROM {SCHEMA}.host_limits WHERE host = %s FOR UPDATE
+                ), decision AS (
+                    SELECT host, state, avail, refill_per_sec,
+                           CASE
+                               WHEN state = 'open' AND opened_at > clock_timestamp() - make_interval(secs => %s) THEN 'circuit_open'
+                               WHEN state = 'half_open' AND probe_started_at > clock_timestamp() - make_interval(secs => %s) THEN 'circuit_open'
+                               WHEN avail < 1 THEN 'rate_limited'
+                               ELSE 'ok'
+                           END AS verdict
+                    FROM cur
+                )
+                UPDATE {SCHEMA}.host_limits h SET
+                    tokens = CASE WHEN d.verdict = 'ok' THEN d.avail - 1 ELSE d.avail END,
+                    updated_at = clock_timestamp(),
+                    state = CASE WHEN d.verdict = 'ok' AND d.state <> 'closed' THEN 'half_open' ELSE h.state END,
+                    probe_started_at = CASE WHEN d.verdict = 'ok' AND d.state <> 'closed' THEN clock_timestamp() ELSE h.probe_started_at END
+                FROM decision d
+                WHERE h.host = d.host
+                RETURNING d.verdict, (1 - d.avail) / d.refill_per_sec AS wait_sec
+            """, (host, CIRCUIT_COOLDOWN_SEC, CIRCUIT_PROBE_TIMEOUT_SEC))
+            verdict, wait_sec = cur.fetchone()
+        if verdict == 'ok':
+            return
+        if verdict == 'circuit_open':
+            raise HostUnavailable(f'circuit open for {host}')
+        if time.monotonic() + float(wait_sec) > deadline:
+            raise HostUnavailable(f'rate limit for {host}')
+        time.sleep(float(wait_sec))
+
+
+def _report_host(guard_conn, host: str, ok: bool) -> None:
+    """Успех закрывает автомат; CIRCUIT_FAILURE_THRESHOLD ошибок подряд или неудачная проба открывают его"""
+    if guard_conn is None:
+        return
+    try:
+        with guard_conn.cursor() as cur:
+            cur.execute(f"""
+                UPDATE {SCHEMA}.host_limits SET
+                    state = CASE
+                        WHEN %(ok)s THEN 'closed'
+                        WHEN state = 'half_open' OR failures + 1 >= %(threshold)s THEN 'open'
+                        ELSE state
+                    END,
+                    opened_at = CASE
+                        WHEN NOT %(ok)s AND (state = 'half_open' OR failures + 1 >= %(threshold)s) THEN clock_timestamp()
+                        ELSE opened_at
+                    END,
+                    failures = CASE WHEN %(ok)s THEN 0 ELSE failures + 1 END,
+                    probe_started_at = NULL
+                WHERE host = %(host)s
+            """, {'ok': ok, 'threshold': CIRCUIT_FAILURE_THRESHOLD, 'host': host})
+    except Exception as e:
+        # Соединение могло быть уже закрыто, если источник не уложился в дедлайн запроса
+        print(f'host_limits report error ({host}): {e}')
+
+
+def _connect_guard():
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    return conn
+
+
+def _avito_url(city: str, prop_type: str, operation: str) -> str:
     cat_map = {
         'apartment': 'kvartiry',
         'house': 'doma_dachi_kottedzhi',
@@ -164,164 +1114,361 @@ def parse_avito_rss(city: str, prop_type: str, operation: str) -> list:
         'commercial': 'kommercheskaya_nedvizhimost',
         '': 'nedvizhimost',
     }
-    op_map = {'sale': 'prodam', 'rent': 'sdam'}
     cat = cat_map.get(prop_type, 'nedvizhimost')
-    op = op_map.get(operation, 'prodam')
+    return f'https://www.avito.ru/{_transliterate(city)}/{cat}?operation=1&s=104&output=rss'
 
-    city_slug = _transliterate(city)
-    url = f'https://www.avito.ru/{city_slug}/{cat}?operation=1&s=104&output=rss'
 
-    try:
-        req = urllib.request.Request(url, headers={
+def _avito_item(item, city: str, prop_type: str, operation: str) -> dict | None:
+    """Элемент RSS-ленты Авито"""
+    title = _text(item, 'title')
+    link = _text(item, 'link')
+    desc = _text(item, 'description')
+    fields = _extract_fields(title, desc)
+    return {
+        'external_id': _listing_id('avito', link, title),
+        'source': 'Авито',
+        'title': title[:200],
+        'price': fields['price'],
+        'location': city,
+        'city': _normalize_city(city),
+        'area': fields['area'],
+        'rooms': fields['rooms'],
+        'floor': None,
+        'total_floors': None,
+        'property_type': prop_type or 'apartment',
+        'operation': operation,
+        'photo_url': fields['photo_url'],
+        'url': link,
+        'description': fields['description'],
+        'phone': '',
+    }
+
+
+def _cian_url(city: str, prop_type: str, operation: str) -> str:
+    op = {'sale': 'sale', 'rent': 'rent'}.get(operation, 'sale')
+    ptype = {
+        'apartment': 'flat', 'house': 'suburban', 'land': 'land', 'commercial': 'commercial', '': 'flat',
+    }.get(prop_type, 'flat')
+    return f'https://www.cian.ru/export/xml/{op}/{ptype}/?region=&locationId=&xml_version=2'
+
+
+def _cian_item(offer, city: str, prop_type: str, operation: str) -> dict | None:
+    """Оффер XML-выгрузки ЦИАН; выгрузка без фильтра региона, поэтому берём только офферы,
+    в адресе которых есть запрошенный город (без адреса город не подтвердить — пропускаем)"""
+    location_raw = _text(offer, 'location/address') or _text(offer, 'address')
+    if not location_raw or _normalize_city(city) not in _normalize_city(location_raw):
+        return None
+    title = _text(offer, 'title') or _text(offer, 'name') or 'Объект недвижимости'
+    link = _text(offer, 'url') or _text(offer, 'link')
+    price_raw = _text(offer, 'bargainTerms/price') or _text(offer, 'price')
+    price = int(price_raw) if price_raw and price_raw.isdigit() else _extract_price(_clean(title))
+    area_raw = _text(offer, 'totalArea') or _text(offer, 'area')
+    area = float(area_raw) if area_raw else None
+    rooms_raw = _text(offer, 'roomsCount') or _text(offer, 'rooms')
+    rooms = int(rooms_raw) if rooms_raw and rooms_raw.isdigit() else None
+    floor_raw = _text(offer, 'floorNumber') or _text(offer, 'floor')
+    floor = int(floor_raw) if floor_raw and floor_raw.isdigit() else None
+    total_raw = _text(offer, 'building/floorsCount') or _text(offer, 'floorsCount')
+    total = int(total_raw) if total_raw and total_raw.isdigit() else None
+    photo = _text(offer, 'photos/photo/fullUrl') or _text(offer, 'photo')
+    return {
+        'external_id': _listing_id('cian', link, title),
+        'source': 'ЦИАН',
+        'title': title[:200],
+        'price': price,
+        'location': location_raw,
+        'city': _normalize_city(city),
+        'area': area,
+        'rooms': rooms,
+        'floor': floor,
+        'total_floors': total,
+        'property_type': prop_type or 'apartment',
+        'operation': operation,
+        'photo_url': photo or '',
+        'url': link or '',
+        'description': '',
+        'phone': '',
+    }
+
+
+def _yandex_url(city: str, prop_type: str, operation: str) -> str:
+    return 'https://realty.yandex.ru/moskva/kupit/kvartira/?output=rss'
+
+
+def _yandex_item(item, city: str, prop_type: str, operation: str) -> dict | None:
+    """Элемент RSS Яндекс.Недвижимости; лента общая, поэтому фильтруем по упоминанию города"""
+    title = _text(item, 'title')
+    link = _text(item, 'link')
+    desc = _text(item, 'description')
+    if city.lower() not in (title + desc).lower():
+        return None
+    fields = _extract_fields(title, desc)
+    return {
+        'external_id': _listing_id('yandex', link, title),
+        'source': 'Яндекс.Недвижимость',
+        'title': title[:200],
+        'price': fields['price'],
+        'location': city,
+        'city': _normalize_city(city),
+        'area': fields['area'],
+        'rooms': fields['rooms'],
+        'floor': None,
+        'total_floors': None,
+        'property_type': prop_type or 'apartment',
+        'operation': operation,
+        'photo_url': fields['photo_url'],
+        'url': link or '',
+        'description': fields['description'],
+        'phone': '',
+    }
+
+
+# Реестр источников. Новый источник = функции build_url/parse_item и запись здесь;
+# включение, таймаут и лимит запросов переопределяются в таблице parser_sources без деплоя
+SOURCE_ADAPTERS = [
+    {
+        'name': 'Авито',
+        'prefix': 'avito',
+        'build_url': _avito_url,
+        'item_tags': ('item',),
+        'parse_item': _avito_item,
+        'headers': {
             'User-Agent': 'Mozilla/5.0 (compatible; RSS reader)',
-            'Accept': 'application/rss+xml, application/xml, text/xml'
+            'Accept': 'application/rss+xml, application/xml, text/xml',
+        },
+        'limit': 30,
+        'scan_limit': 60,
+        'timeout': HTTP_TIMEOUT,
+        'rate_per_minute': 30,
+        'burst': 5,
+    },
+    {
+        'name': 'ЦИАН',
+        'prefix': 'cian',
+        'build_url': _cian_url,
+        'item_tags': ('offer', 'item'),
+        'parse_item': _cian_item,
+        'headers': {'User-Agent': 'Mozilla/5.0'},
+        'limit': 20,
+        'scan_limit': 100,
+        'timeout': HTTP_TIMEOUT,
+        'rate_per_minute': 30,
+        'burst': 5,
+    },
+    {
+        'name': 'Яндекс.Недвижимость',
+        'prefix': 'yandex',
+        'build_url': _yandex_url,
+        'item_tags': ('item',),
+        'parse_item': _yandex_item,
+        'headers': {'User-Agent': 'Mozilla/5.0'},
+        'limit': 20,
+        'scan_limit': 40,
+        'timeout': HTTP_TIMEOUT,
+        'rate_per_minute': 30,
+        'burst': 5,
+    },
+]
+
+SOURCE_PREFIXES = {a['name']: a['prefix'] for a in SOURCE_ADAPTERS}
+
+
+def load_adapters(cursor) -> list:
+    """Включённые адаптеры с учётом настроек из parser_sources"""
+    cursor.execute(f"SELECT name, enabled, timeout_sec, rate_per_minute FROM {SCHEMA}.parser_sources")
+    settings = {row['name']: row for row in cursor.fetchall()}
+    adapters = []
+    for adapter in SOURCE_ADAPTERS:
+        row = settings.get(adapter['name'])
+        if row is None:
+            adapters.append(adapter)
+            continue
+        if not row['enabled']:
+            continue
+        adapters.append({
+            **adapter,
+            'timeout': row['timeout_sec'] or adapter['timeout'],
+            'rate_per_minute': row['rate_per_minute'] if row['rate_per_minute'] is not None else adapter['rate_per_minute'],
         })
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            data = resp.read()
-        root = ET.fromstring(data)
-        items = root.findall('.//item')
-
-        for i, item in enumerate(items[:30]):
-            title = _text(item, 'title')
-            link = _text(item, 'link')
-            desc = _text(item, 'description')
-            ext_id = f"avito_{i}_{hash(link) % 999999}"
-
-            price = _extract_price(title + ' ' + desc)
-            area = _extract_area(title + ' ' + desc)
-            rooms = _extract_rooms(title)
-            photo = _extract_img(desc)
-
-            results.append({
-                'external_id': ext_id,
-                'source': 'Авито',
-                'title': title[:200],
-                'price': price,
-                'location': city,
-                'area': area,
-                'rooms': rooms,
-                'floor': None,
-                'total_floors': None,
-                'property_type': prop_type or 'apartment',
-                'operation': operation,
-                'photo_url': photo,
-                'url': link,
-                'description': _clean(desc)[:500],
-                'phone': '',
-            })
-    except Exception as e:
-        print(f'Avito RSS error: {e}')
-    return results
+    return adapters
 
 
-def parse_cian_rss(city: str, prop_type: str, operation: str) -> list:
-    """Парсит RSS-ленту ЦИАН"""
-    results = []
-    city_map = {
-        'Москва': 'moscow', 'Санкт-Петербург': 'spb', 'Севастополь': 'sevastopol',
-        'Симферополь': 'simferopol', 'Краснодар': 'krasnodar', 'Ростов': 'rostov-na-donu',
-    }
-    city_slug = city_map.get(city, city.lower().replace(' ', '-'))
-    op_map = {'sale': 'sale', 'rent': 'rent'}
-    op = op_map.get(operation, 'sale')
-    type_map = {'apartment': 'flat', 'house': 'suburban', 'land': 'land', '': 'flat'}
-    ptype = type_map.get(prop_type, 'flat')
+def record_source_stats(cursor, stats: list) -> None:
+    """Накапливает по источникам число запусков, ошибок, объявлений и суммарное время"""
+    totals = {}
+    for st in stats:
+        t = totals.setdefault(st['source'], {'runs': 0, 'errors': 0, 'items': 0, 'total_ms': 0, 'last_error': None})
+        t['runs'] += 1
+        t['items'] += st['count']
+        t['total_ms'] += st['latency_ms']
+        if st['error']:
+            t['errors'] += 1
+            t['last_error'] = st['error']
+    if not totals:
+        return
+    rows = [(name, t['runs'], t['errors'], t['items'], t['total_ms'], t['last_error']) for name, t in totals.items()]
+    execute_values(cursor, f"""
+        INSERT INTO {SCHEMA}.parser_sources AS ps (name, runs, errors, items, total_ms, last_error)
+        VALUES %s
+        ON CONFLICT (name) DO UPDATE SET
+            runs = ps.runs + EXCLUDED.runs,
+            errors = ps.errors + EXCLUDED.errors,
+            items = ps.items + EXCLUDED.items,
+            total_ms = ps.total_ms + EXCLUDED.total_ms,
+            last_error = COALESCE(EXCLUDED.last_error, ps.last_error),
+            last_run_at = CURRENT_TIMESTAMP
+    """, rows, page_size=len(rows))
+    cursor.connection.commit()
 
-    url = f'https://www.cian.ru/export/xml/{op}/{ptype}/?region=&locationId=&xml_version=2'
-    try:
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            data = resp.read()
-        root = ET.fromstring(data)
-        offers = root.findall('.//offer') or root.findall('.//item')
-
-        for i, offer in enumerate(offers[:20]):
-            title = _text(offer, 'title') or _text(offer, 'name') or 'Объект недвижимости'
-            link = _text(offer, 'url') or _text(offer, 'link')
-            price_raw = _text(offer, 'bargainTerms/price') or _text(offer, 'price')
-            price = int(price_raw) if price_raw and price_raw.isdigit() else _extract_price(title)
-            area_raw = _text(offer, 'totalArea') or _text(offer, 'area')
-            area = float(area_raw) if area_raw else None
-            rooms_raw = _text(offer, 'roomsCount') or _text(offer, 'rooms')
-            rooms = int(rooms_raw) if rooms_raw and rooms_raw.isdigit() else None
-            floor_raw = _text(offer, 'floorNumber') or _text(offer, 'floor')
-            floor = int(floor_raw) if floor_raw and floor_raw.isdigit() else None
-            total_raw = _text(offer, 'building/floorsCount') or _text(offer, 'floorsCount')
-            total = int(total_raw) if total_raw and total_raw.isdigit() else None
-            location_raw = _text(offer, 'location/address') or _text(offer, 'address') or city
-            photo = _text(offer, 'photos/photo/fullUrl') or _text(offer, 'photo')
-
-            results.append({
-                'external_id': f'cian_{i}_{hash(link or title) % 999999}',
-                'source': 'ЦИАН',
-                'title': title[:200],
-                'price': price,
-                'location': location_raw,
-                'area': area,
-                'rooms': rooms,
-                'floor': floor,
-                'total_floors': total,
-                'property_type': prop_type or 'apartment',
-                'operation': operation,
-                'photo_url': photo or '',
-                'url': link or '',
-                'description': '',
-                'phone': '',
-            })
-    except Exception as e:
-        print(f'CIAN RSS error: {e}')
-    return results
 
+TRACKING_PARAMS = ('utm_', 'from', 'ref', 'context', 'src', 'yclid', 'gclid')
 
-def parse_domofond_rss(city: str, prop_type: str, operation: str) -> list:
-    """Парсит RSS Domofond/Яндекс.Недвижимость"""
-    results = []
-    type_map = {'apartment': 'APARTMENT', 'house': 'HOUSE', 'land': 'LOT', '': 'APARTMENT'}
-    op_map = {'sale': 'SELL', 'rent': 'RENT'}
-    ptype = type_map.get(prop_type, 'APARTMENT')
-    op = op_map.get(operation, 'SELL')
-    city_encoded = urllib.request.quote(city)
-    url = f'https://realty.yandex.ru/moskva/kupit/kvartira/?output=rss'
 
+def _listing_id(prefix: str, url: str, title: str = '') -> str:
+    """Стабильный идентификатор объявления: id оффера из URL, иначе sha1 нормализованного URL"""
+    normalized = _normalize_url(url)
+    if normalized:
+        native = re.search(r'[_/](\d{6,})/?$', urllib.parse.urlsplit(normalized).path)
+        if native:
+            return f'{prefix}_{native.group(1)}'
+        return f'{prefix}_{hashlib.sha1(normalized.encode()).hexdigest()[:20]}'
+    # Без ссылки остаётся только заголовок — лучше, чем солёный hash() процесса
+    return f'{prefix}_t{hashlib.sha1(_clean(title).lower().encode()).hexdigest()[:20]}'
+
+
+def _normalize_url(url: str) -> str:
+    if not url:
+        return ''
+    parts = urllib.parse.urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for sub in ('www.', 'm.'):
+        if host.startswith(sub):
+            host = host[len(sub):]
+    query = sorted(
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    )
+    return urllib.parse.urlunsplit(('https', host, parts.path.rstrip('/'), urllib.parse.urlencode(query), ''))
+
+
+def backfill_listing_ids(cursor) -> dict:
+    """Разовый пересчёт external_id по новой схеме со схлопыванием дублей (остаётся самая свежая строка)"""
+    cursor.execute(f"SELECT id, source, external_id, url, title FROM {SCHEMA}.parsed_listings")
+    mapping = []
+    for row in cursor.fetchall():
+        prefix = SOURCE_PREFIXES.get(row['source'], 'listing')
+        new_id = _listing_id(prefix, row['url'] or '', row['title'] or '')
+        mapping.append((row['id'], new_id))
+
+    if not mapping:
+        return {'total': 0, 'deleted': 0, 'updated': 0}
+
+    cursor.execute("CREATE TEMP TABLE listing_ids (id INTEGER PRIMARY KEY, external_id VARCHAR(255)) ON COMMIT DROP")
+    execute_values(cursor, "INSERT INTO listing_ids (id, external_id) VALUES %s", mapping, page_size=1000)
+    cursor.execute(f"""
+        DELETE FROM {SCHEMA}.parsed_listings p
+        USING (
+            SELECT l.id, ROW_NUMBER() OVER (
+                PARTITION BY l.source, m.external_id ORDER BY l.parsed_at DESC, l.id DESC
+            ) AS rn
+            FROM {SCHEMA}.parsed_listings l
+            JOIN listing_ids m ON m.id = l.id
+        ) d
+        WHERE p.id = d.id AND d.rn > 1
+    """)
+    deleted = cursor.rowcount
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.parsed_listings p SET external_id = m.external_id
+        FROM listing_ids m
+        WHERE m.id = p.id AND p.external_id <> m.external_id
+    """)
+    updated = cursor.rowcount
+    cursor.connection.commit()
+    return {'total': len(mapping), 'deleted': deleted, 'updated': updated}
+
+
+def _normalize_city(city: str) -> str:
+    return (city or '').strip().lower().replace('ё', 'е')
+
+
+class FeedNotModified(Exception):
+    """Лента не изменилась с прошлого разбора (304 или тот же хэш начала ленты)"""
+
+
+def _feed_chunks(req, feed_cache: dict | None, cache_key: str, timeout: float = HTTP_TIMEOUT):
+    """Условный GET ленты: отдаёт тело ответа чанками или бросает FeedNotModified.
+    Хэшируется начало ленты (FEED_HEAD_BYTES): ленты отсортированы от новых к старым,
+    и неизменное начало означает, что новых объявлений нет."""
+    cached = feed_cache.get(cache_key) if feed_cache is not None else None
+    if cached:
+        if cached.get('etag'):
+            req.add_header('If-None-Match', cached['etag'])
+        if cached.get('last_modified'):
+            req.add_header('If-Modified-Since', cached['last_modified'])
     try:
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            data = resp.read()
-        root = ET.fromstring(data)
-        items = root.findall('.//item')
-
-        for i, item in enumerate(items[:20]):
-            title = _text(item, 'title')
-            link = _text(item, 'link')
-            desc = _text(item, 'description')
-            if city.lower() not in (title + desc).lower():
-                continue
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            feed_cache[cache_key] = {**cached, 'dirty': True}
+            raise FeedNotModified(cache_key)
+        raise
+
+    with resp:
+        head = resp.read(FEED_HEAD_BYTES)
+        if feed_cache is not None:
+            body_hash = hashlib.sha256(head).hexdigest()
+            feed_cache[cache_key] = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'body_hash': body_hash,
+                'dirty': True,
+            }
+            if cached and cached.get('body_hash') == body_hash:
+                raise FeedNotModified(cache_key)
+        yield head
+        while chunk := resp.read(FEED_CHUNK_BYTES):
+            yield chunk
+
+
+def load_feed_cache(cursor) -> dict:
+    cursor.execute(f"SELECT cache_key, etag, last_modified, body_hash FROM {SCHEMA}.feed_cache")
+    return {row['cache_key']: dict(row) for row in cursor.fetchall()}
 
-            price = _extract_price(title + ' ' + desc)
-            area = _extract_area(title + ' ' + desc)
-            rooms = _extract_rooms(title)
-            photo = _extract_img(desc)
-
-            results.append({
-                'external_id': f'yandex_{i}_{hash(link or title) % 999999}',
-                'source': 'Яндекс.Недвижимость',
-                'title': title[:200],
-                'price': price,
-                'location': city,
-                'area': area,
-                'rooms': rooms,
-                'floor': None,
-                'total_floors': None,
-                'property_type': prop_type or 'apartment',
-                'operation': operation,
-                'photo_url': photo or '',
-                'url': link or '',
-                'description': _clean(desc)[:500],
-                'phone': '',
-            })
-    except Exception as e:
-        print(f'Yandex Realty RSS error: {e}')
-    return results
+
+def save_feed_cache(cursor, feed_cache: dict) -> None:
+    rows = [
+        (key, entry.get('etag'), entry.get('last_modified'), entry.get('body_hash'))
+        for key, entry in feed_cache.items() if entry.get('dirty')
+    ]
+    if not rows:
+        return
+    execute_values(cursor, f"""
+        INSERT INTO {SCHEMA}.feed_cache (cache_key, etag, last_modified, body_hash)
+        VALUES %s
+        ON CONFLICT (cache_key) DO UPDATE SET
+            etag=EXCLUDED.etag, last_modified=EXCLUDED.last_modified,
+            body_hash=EXCLUDED.body_hash, checked_at=CURRENT_TIMESTAMP
+    """, rows, page_size=len(rows))
+    cursor.connection.commit()
+
+
+def _iter_feed(chunks, tags: tuple):
+    """Потоково разбирает XML-ленту из чанков и отдаёт элементы с тегами из tags.
+    Обработанный элемент сразу отцепляется от родителя, поэтому память не растёт с размером ленты,
+    а прерывание цикла у вызывающего останавливает чтение ответа."""
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    stack = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag in tags:
+                yield elem
+                if stack:
+                    stack[-1].remove(elem)
 
 
 def _text(elem, path: str) -> str:
@@ -331,28 +1478,57 @@ def _text(elem, path: str) -> str:
     return ''
 
 
+TAG_RE = re.compile(r'<[^>]+>')
+SPACE_RE = re.compile(r'\s+')
+PRICE_RE = re.compile(r'(\d[\d\s]{2,})\s*(?:руб|₽|rub)', re.IGNORECASE)
+PRICE_FALLBACK_RE = re.compile(r'(\d{4,})')
+AREA_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*м²?', re.IGNORECASE)
+ROOMS_RE = re.compile(r'(\d)\s*-?\s*комн')
+WORD_RE = re.compile(r'\w+')
+IMG_RE = re.compile(r'<img[^>]+src=["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+def _extract_fields(title: str, desc: str) -> dict:
+    """Разбирает title/description объявления за один проход: HTML чистится один раз,
+    цена, площадь, комнаты и фото берутся из уже очищенного текста"""
+    photo = ''
+    if desc:
+        match = IMG_RE.search(desc)
+        if match:
+            photo = match.group(1)
+    description = _clean(desc)
+    text = f'{_clean(title)} {description}'
+    return {
+        'price': _extract_price(text),
+        'area': _extract_area(text),
+        'rooms': _extract_rooms(title),
+        'photo_url': photo,
+        'description': description[:500],
+    }
+
+
 def _clean(text: str) -> str:
     if not text:
         return ''
     text = html.unescape(text)
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\s+', ' ', text)
+    text = TAG_RE.sub('', text)
+    text = SPACE_RE.sub(' ', text)
     return text.strip()
 
 
 def _extract_price(text: str) -> int | None:
-    text = _clean(text)
-    match = re.search(r'(\d[\d\s]{2,})\s*(?:руб|₽|rub)', text, re.IGNORECASE)
+    """Ожидает уже очищенный текст (см. _clean)"""
+    match = PRICE_RE.search(text)
     if match:
-        return int(re.sub(r'\s', '', match.group(1)))
-    match = re.search(r'(\d{4,})', text.replace(' ', ''))
+        return int(SPACE_RE.sub('', match.group(1)))
+    match = PRICE_FALLBACK_RE.search(text.replace(' ', ''))
     if match:
         return int(match.group(1))
     return None
 
 
 def _extract_area(text: str) -> float | None:
-    match = re.search(r'(\d+(?:[.,]\d+)?)\s*м²?', text, re.IGNORECASE)
+    match = AREA_RE.search(text)
     if match:
         return float(match.group(1).replace(',', '.'))
     return None
@@ -362,21 +1538,12 @@ def _extract_rooms(text: str) -> int | None:
     text_l = text.lower()
     if 'студ' in text_l:
         return 0
-    match = re.search(r'(\d)\s*[-]?\s*комн', text_l)
+    match = ROOMS_RE.search(text_l)
     if match:
         return int(match.group(1))
     return None
 
 
-def _extract_img(desc: str) -> str:
-    if not desc:
-        return ''
-    match = re.search(r'<img[^>]+src=["\']([^"\']+)["\']', desc, re.IGNORECASE)
-    if match:
-        return match.group(1)
-    return ''
-
-
 def _transliterate(text: str) -> str:
     table = {
         'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
@@ -4,12 +4,17 @@ Backend функция для парсинга RSS-лент новостей о
 """
 import json
 import os
-from typing import Dict, Any, List
+import hashlib
+from typing import Dict, Any, List, Optional
+import urllib.error
 import urllib.request
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import html
 
+# Кэш валидаторов условного GET и уже разобранных статей (переживает тёплые вызовы контейнера)
+FEED_CACHE_PATH = '/tmp/rss-parser-feed-cache.json'
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Парсит RSS-ленты новостей об ипотеке из разных источников
@@ -79,17 +84,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         ]
         
+        feed_cache = load_feed_cache()
+        
         for feed_config in rss_feeds:
             try:
                 articles.extend(parse_rss_feed(
                     feed_config['url'],
                     feed_config['source'],
-                    feed_config['keywords']
+                    feed_config['keywords'],
+                    feed_cache
                 ))
             except Exception as e:
                 print(f"Error parsing {feed_config['source']}: {str(e)}")
                 continue
         
+        save_feed_cache(feed_cache)
+        
         # Если не удалось получить новости, возвращаем моковые данные
         if not articles:
             articles = get_mock_articles()
@@ -125,20 +135,81 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'isBase64Encoded': False
     }
 
-def parse_rss_feed(url: str, source: str, keywords: List[str]) -> List[Dict[str, str]]:
+def load_feed_cache() -> Dict[str, Any]:
     """
-    Парсит RSS-ленту и фильтрует новости по ключевым словам
+    Читает файловый кэш лент (ETag/Last-Modified, хэш тела и разобранные статьи)
     """
-    articles = []
+    try:
+        with open(FEED_CACHE_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_feed_cache(feed_cache: Dict[str, Any]) -> None:
+    """
+    Сохраняет кэш лент, если какая-то лента была перечитана
+    """
+    dirty = [entry for entry in feed_cache.values() if entry.get('dirty')]
+    if not dirty:
+        return
+    for entry in dirty:
+        del entry['dirty']
+    try:
+        with open(FEED_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(feed_cache, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"Error saving feed cache: {str(e)}")
+
+def fetch_feed(url: str, feed_cache: Dict[str, Any]) -> Optional[bytes]:
+    """
+    Условный GET ленты: None, если лента не изменилась (304 или тот же хэш тела)
+    """
+    req = urllib.request.Request(
+        url,
+        headers={'User-Agent': 'Mozilla/5.0'}
+    )
+    cached = feed_cache.get(url)
+    if cached:
+        if cached.get('etag'):
+            req.add_header('If-None-Match', cached['etag'])
+        if cached.get('last_modified'):
+            req.add_header('If-Modified-Since', cached['last_modified'])
     
     try:
-        req = urllib.request.Request(
-            url,
-            headers={'User-Agent': 'Mozilla/5.0'}
-        )
-        
         with urllib.request.urlopen(req, timeout=10) as response:
             xml_data = response.read()
+            headers = response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return None
+        raise
+    
+    body_hash = hashlib.sha256(xml_data).hexdigest()
+    if cached and cached.get('body_hash') == body_hash:
+        return None
+    
+    feed_cache[url] = {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'body_hash': body_hash,
+        'articles': [],
+        'dirty': True
+    }
+    return xml_data
+
+def parse_rss_feed(url: str, source: str, keywords: List[str], feed_cache: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
+    """
+    Парсит RSS-ленту и фильтрует новости по ключевым словам.
+    Если лента не изменилась с прошлого запроса, отдаёт статьи из feed_cache без разбора
+    """
+    articles = []
+    if feed_cache is None:
+        feed_cache = {}
+    
+    try:
+        xml_data = fetch_feed(url, feed_cache)
+        if xml_data is None:
+            return feed_cache[url].get('articles', [])
         
         root = ET.fromstring(xml_data)
         
@@ -183,7 +254,11 @@ def parse_rss_feed(url: str, source: str, keywords: List[str]) -> List[Dict[str,
                 print(f"Error parsing item: {str(e)}")
                 continue
     
+        feed_cache[url]['articles'] = articles
+    
     except Exception as e:
+        # Не запоминаем валидаторы ленты, которую не удалось разобрать
+        feed_cache.pop(url, None)
         print(f"Error fetching RSS from {url}: {str(e)}")
     
     return articles
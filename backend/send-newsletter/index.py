@@ -1,11 +1,12 @@
 import json
 import os
 import psycopg2
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Dict, Any
 
+import mailer
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Отправка email-рассылки подписчикам о новых статьях
@@ -70,12 +71,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        smtp_host = os.environ.get('SMTP_HOST')
-        smtp_port = int(os.environ.get('SMTP_PORT', 587))
-        smtp_user = os.environ.get('SMTP_USER')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
+        smtp_user = mailer.sender()
         
-        if not all([smtp_host, smtp_user, smtp_password]):
+        if not mailer.is_configured():
             return {
                 'statusCode': 500,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -88,10 +86,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         sent_count = 0
         failed_count = 0
         
-        server = smtplib.SMTP(smtp_host, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        
         for subscriber_email, subscriber_name in subscribers:
             try:
                 msg = MIMEMultipart('alternative')
@@ -124,15 +118,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 part = MIMEText(html_body, 'html')
                 msg.attach(part)
                 
-                server.send_message(msg)
+                # Тёплое соединение mailer: рукопожатие и логин — один раз на контейнер, а не на рассылку
+                mailer.send_message(msg)
                 sent_count += 1
                 
             except Exception as e:
                 failed_count += 1
                 print(f"Failed to send to {subscriber_email}: {str(e)}")
         
-        server.quit()
-        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,14 @@
+-- Журнал фоновых запусков прогрева кэша parsed_listings (action=refresh)
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.parser_refresh_runs (
+    id SERIAL PRIMARY KEY,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INTEGER NOT NULL,
+    combinations INTEGER NOT NULL DEFAULT 0,
+    fetched INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    source_timeouts INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_parser_refresh_runs_finished ON t_p26758318_mortgage_support_pro.parser_refresh_runs(finished_at DESC);
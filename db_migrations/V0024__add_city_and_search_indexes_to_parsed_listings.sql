@@ -0,0 +1,17 @@
+-- Нормализованный город заполняется парсером: поиск по городу идёт по равенству, а не по LIKE '%город%'
+ALTER TABLE t_p26758318_mortgage_support_pro.parsed_listings
+  ADD COLUMN IF NOT EXISTS city VARCHAR(100);
+
+-- Для старых строк Авито/Яндекс в location лежит название города
+UPDATE t_p26758318_mortgage_support_pro.parsed_listings
+SET city = LOWER(REPLACE(TRIM(location), 'ё', 'е'))
+WHERE city IS NULL AND location IS NOT NULL AND location NOT LIKE '%,%';
+
+-- Основной индекс выдачи поиска: фильтр по городу/операции/типу и сортировка по свежести
+CREATE INDEX IF NOT EXISTS idx_parsed_listings_search
+  ON t_p26758318_mortgage_support_pro.parsed_listings(city, operation, property_type, parsed_at DESC);
+
+-- Свободный поиск по адресу (location ILIKE '%...%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_parsed_listings_location_trgm
+  ON t_p26758318_mortgage_support_pro.parsed_listings USING gin (location gin_trgm_ops);
@@ -0,0 +1,14 @@
+-- Валидаторы условного GET для внешних лент (property-parser, news-parser)
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.feed_cache (
+    cache_key TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body_hash VARCHAR(64),
+    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.feed_cache.cache_key IS 'URL ленты (для property-parser — с параметрами разбора после #)';
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.feed_cache.body_hash IS 'sha256 тела ленты (для property-parser — её начала)';
+
+ALTER TABLE t_p26758318_mortgage_support_pro.parser_refresh_runs
+  ADD COLUMN IF NOT EXISTS feeds_not_modified INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,30 @@
+-- Архив устаревших объявлений: action=expire переносит сюда давно неактивные строки parsed_listings
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.parsed_listings_archive (
+    id INTEGER PRIMARY KEY,
+    external_id VARCHAR(255) NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    title TEXT NOT NULL,
+    price BIGINT,
+    location TEXT,
+    city VARCHAR(100),
+    area NUMERIC(10,2),
+    rooms INTEGER,
+    floor INTEGER,
+    total_floors INTEGER,
+    property_type VARCHAR(50),
+    operation VARCHAR(20),
+    photo_url TEXT,
+    url TEXT,
+    description TEXT,
+    phone VARCHAR(50),
+    parsed_at TIMESTAMP,
+    is_active BOOLEAN,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_parsed_listings_archive_archived_at
+  ON t_p26758318_mortgage_support_pro.parsed_listings_archive(archived_at);
+
+-- Отбор кандидатов на деактивацию/архивацию по возрасту
+CREATE INDEX IF NOT EXISTS idx_parsed_listings_parsed_at
+  ON t_p26758318_mortgage_support_pro.parsed_listings(parsed_at);
@@ -0,0 +1,17 @@
+-- Настройки и накопленная статистика адаптеров источников property-parser
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.parser_sources (
+    name VARCHAR(50) PRIMARY KEY,
+    enabled BOOLEAN NOT NULL DEFAULT true,
+    timeout_sec INTEGER,
+    rate_per_minute INTEGER,
+    runs INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    items INTEGER NOT NULL DEFAULT 0,
+    total_ms BIGINT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    last_run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.parser_sources.enabled IS 'Выключенный источник пропускается без деплоя';
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.parser_sources.timeout_sec IS 'Переопределение таймаута адаптера, NULL — значение из кода';
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.parser_sources.rate_per_minute IS 'Переопределение лимита запросов в минуту, NULL — значение из кода';
@@ -0,0 +1,8 @@
+-- Ссылки на то же объявление на других площадках (склейка дублей в property-parser)
+ALTER TABLE t_p26758318_mortgage_support_pro.parsed_listings
+  ADD COLUMN IF NOT EXISTS alt_sources JSONB DEFAULT '[]'::jsonb;
+
+ALTER TABLE t_p26758318_mortgage_support_pro.parsed_listings_archive
+  ADD COLUMN IF NOT EXISTS alt_sources JSONB DEFAULT '[]'::jsonb;
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.parsed_listings.alt_sources IS 'Дубли с других площадок: [{"source": ..., "url": ...}]';
@@ -0,0 +1,30 @@
+-- Журнал изменений цен объявлений (append-only), заполняется при bulk upsert в property-parser
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.listing_price_history (
+    id BIGSERIAL PRIMARY KEY,
+    listing_id INTEGER NOT NULL,
+    city VARCHAR(100),
+    operation VARCHAR(20),
+    property_type VARCHAR(50),
+    old_price BIGINT NOT NULL,
+    new_price BIGINT NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_listing_price_history_city ON t_p26758318_mortgage_support_pro.listing_price_history(city, changed_at DESC);
+CREATE INDEX IF NOT EXISTS idx_listing_price_history_changed_at ON t_p26758318_mortgage_support_pro.listing_price_history(changed_at);
+
+-- Дневная сводка по городам для action=price_history (пересчитывается в action=refresh)
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.listing_price_daily (
+    day DATE NOT NULL,
+    city VARCHAR(100) NOT NULL,
+    operation VARCHAR(20) NOT NULL,
+    property_type VARCHAR(50) NOT NULL,
+    changes INTEGER NOT NULL DEFAULT 0,
+    drops INTEGER NOT NULL DEFAULT 0,
+    rises INTEGER NOT NULL DEFAULT 0,
+    avg_drop_pct NUMERIC(6,2),
+    max_drop_pct NUMERIC(6,2),
+    PRIMARY KEY (day, city, operation, property_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_listing_price_daily_city ON t_p26758318_mortgage_support_pro.listing_price_daily(city, day DESC);
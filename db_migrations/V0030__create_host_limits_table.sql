@@ -0,0 +1,14 @@
+-- Лимитер запросов (token bucket) и автомат отключения для внешних хостов property-parser
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.host_limits (
+    host VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    capacity DOUBLE PRECISION NOT NULL,
+    refill_per_sec DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    state VARCHAR(10) NOT NULL DEFAULT 'closed',
+    failures INTEGER NOT NULL DEFAULT 0,
+    opened_at TIMESTAMP,
+    probe_started_at TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.host_limits.state IS 'closed — запросы идут, open — отказ без запроса, half_open — идёт пробный запрос';
@@ -0,0 +1,11 @@
+-- Ссылка на исходное объявление: по ней пакетное сохранение из парсера пропускает уже привязанные объекты
+ALTER TABLE t_p26758318_mortgage_support_pro.client_properties
+  ADD COLUMN IF NOT EXISTS source_url TEXT NOT NULL DEFAULT '';
+
+-- Ранее ссылка дописывалась только в описание
+UPDATE t_p26758318_mortgage_support_pro.client_properties
+SET source_url = substring(description from 'Источник: (\S+)')
+WHERE source_url = '' AND description LIKE '%Источник: %';
+
+CREATE INDEX IF NOT EXISTS idx_client_properties_client_url
+  ON t_p26758318_mortgage_support_pro.client_properties(client_id, source_url);
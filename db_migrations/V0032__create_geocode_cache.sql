@@ -0,0 +1,26 @@
+-- Кэш геокодирования адресов и координаты объявлений для поиска в радиусе (property-parser)
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.geocode_cache (
+    address_key VARCHAR(500) PRIMARY KEY,
+    address TEXT NOT NULL,
+    lat DOUBLE PRECISION,
+    lon DOUBLE PRECISION,
+    provider VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.geocode_cache.lat IS 'NULL — геокодер не нашёл адрес, повторно не запрашиваем';
+
+ALTER TABLE t_p26758318_mortgage_support_pro.parsed_listings
+  ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION,
+  ADD COLUMN IF NOT EXISTS lon DOUBLE PRECISION,
+  ADD COLUMN IF NOT EXISTS geohash VARCHAR(12);
+
+ALTER TABLE t_p26758318_mortgage_support_pro.parsed_listings_archive
+  ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION,
+  ADD COLUMN IF NOT EXISTS lon DOUBLE PRECISION,
+  ADD COLUMN IF NOT EXISTS geohash VARCHAR(12);
+
+-- Поиск near= сводится к нескольким префиксам geohash: LIKE 'prefix%' идёт по btree с pattern_ops
+CREATE INDEX IF NOT EXISTS idx_parsed_listings_geohash
+  ON t_p26758318_mortgage_support_pro.parsed_listings (geohash varchar_pattern_ops)
+  WHERE is_active = true AND geohash IS NOT NULL;
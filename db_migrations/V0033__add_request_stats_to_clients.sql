@@ -0,0 +1,47 @@
+-- Денормализованные счётчики заявок клиента для списка клиентов в CRM (без агрегата по requests)
+ALTER TABLE t_p26758318_mortgage_support_pro.clients
+  ADD COLUMN IF NOT EXISTS requests_count INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS last_request_at TIMESTAMP;
+
+UPDATE t_p26758318_mortgage_support_pro.clients c
+SET requests_count = s.cnt, last_request_at = s.last_at
+FROM (
+    SELECT client_id, COUNT(*) AS cnt, MAX(created_at) AS last_at
+    FROM t_p26758318_mortgage_support_pro.requests
+    WHERE client_id IS NOT NULL
+    GROUP BY client_id
+) s
+WHERE s.client_id = c.id;
+
+-- Заявки пишут несколько функций (crm-submit, register-submit, crm-api), поэтому счётчики ведёт триггер.
+-- Пересчёт по одному клиенту идёт по idx_requests_client_id и корректен и для удалений.
+CREATE OR REPLACE FUNCTION t_p26758318_mortgage_support_pro.sync_client_request_stats() RETURNS trigger AS $$
+DECLARE
+    affected INTEGER;
+BEGIN
+    FOREACH affected IN ARRAY ARRAY[
+        CASE WHEN TG_OP <> 'DELETE' THEN NEW.client_id END,
+        CASE WHEN TG_OP <> 'INSERT' THEN OLD.client_id END
+    ] LOOP
+        CONTINUE WHEN affected IS NULL;
+        UPDATE t_p26758318_mortgage_support_pro.clients c
+        SET requests_count = s.cnt, last_request_at = s.last_at
+        FROM (
+            SELECT COUNT(*) AS cnt, MAX(created_at) AS last_at
+            FROM t_p26758318_mortgage_support_pro.requests
+            WHERE client_id = affected
+        ) s
+        WHERE c.id = affected;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_requests_client_stats ON t_p26758318_mortgage_support_pro.requests;
+CREATE TRIGGER trg_requests_client_stats
+  AFTER INSERT OR DELETE OR UPDATE OF client_id ON t_p26758318_mortgage_support_pro.requests
+  FOR EACH ROW EXECUTE FUNCTION t_p26758318_mortgage_support_pro.sync_client_request_stats();
+
+-- Постраничный список клиентов (keyset по created_at, id)
+CREATE INDEX IF NOT EXISTS idx_clients_created_at
+  ON t_p26758318_mortgage_support_pro.clients (created_at DESC, id DESC);
@@ -0,0 +1,32 @@
+-- Поиск клиентов в CRM (crm-api action=search_clients) без выгрузки всей таблицы в браузер
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Телефон только цифрами: "+7 (978) 123-45-67" и "89781234567" ищутся одинаково
+ALTER TABLE t_p26758318_mortgage_support_pro.clients
+  ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(50)
+    GENERATED ALWAYS AS (regexp_replace(COALESCE(phone, ''), '\D', '', 'g')) STORED;
+
+-- Полнотекстовый вектор: имя важнее email, email важнее заметок
+ALTER TABLE t_p26758318_mortgage_support_pro.clients
+  ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+      setweight(to_tsvector('simple', COALESCE(name, '') || ' ' || COALESCE(full_name, '')), 'A') ||
+      setweight(to_tsvector('simple', COALESCE(email, '')), 'B') ||
+      setweight(to_tsvector('russian', COALESCE(notes, '')), 'C')
+    ) STORED;
+
+-- Строка для нечёткого поиска по подстроке имени/email (опечатки, части слов)
+ALTER TABLE t_p26758318_mortgage_support_pro.clients
+  ADD COLUMN IF NOT EXISTS search_text TEXT
+    GENERATED ALWAYS AS (
+      LOWER(COALESCE(name, '') || ' ' || COALESCE(full_name, '') || ' ' || COALESCE(email, ''))
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clients_search_vector
+  ON t_p26758318_mortgage_support_pro.clients USING gin (search_vector);
+
+CREATE INDEX IF NOT EXISTS idx_clients_search_text_trgm
+  ON t_p26758318_mortgage_support_pro.clients USING gin (search_text gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_clients_phone_digits_trgm
+  ON t_p26758318_mortgage_support_pro.clients USING gin (phone_digits gin_trgm_ops);
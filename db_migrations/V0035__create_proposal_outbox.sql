@@ -0,0 +1,27 @@
+-- Очередь отправки подборок клиентам (crm-api: send_proposal ставит в очередь, deliver_outbox доставляет)
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.proposal_outbox (
+    id SERIAL PRIMARY KEY,
+    job_id VARCHAR(36) NOT NULL,
+    client_id INTEGER,
+    channel VARCHAR(20) NOT NULL,
+    recipient VARCHAR(255) NOT NULL DEFAULT '',
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    sent_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.proposal_outbox.status IS 'pending — ждёт попытки, sending — взята воркером, sent — доставлено, failed — попытки исчерпаны';
+
+CREATE INDEX IF NOT EXISTS idx_proposal_outbox_job_id
+  ON t_p26758318_mortgage_support_pro.proposal_outbox (job_id);
+
+-- Выборка воркера: только недоставленные, по времени следующей попытки
+CREATE INDEX IF NOT EXISTS idx_proposal_outbox_due
+  ON t_p26758318_mortgage_support_pro.proposal_outbox (next_attempt_at)
+  WHERE status IN ('pending', 'sending');
@@ -0,0 +1,53 @@
+-- Лента изменений CRM (crm-api action=changes): updated_at ведут триггеры, удаления пишутся в надгробия
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.crm_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    entity VARCHAR(20) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_crm_tombstones_deleted_at
+  ON t_p26758318_mortgage_support_pro.crm_tombstones (deleted_at, id);
+
+-- updated_at обновляется при любом UPDATE, кто бы его ни делал (crm-api, формы, триггер счётчиков)
+CREATE OR REPLACE FUNCTION t_p26758318_mortgage_support_pro.touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p26758318_mortgage_support_pro.record_crm_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p26758318_mortgage_support_pro.crm_tombstones (entity, entity_id)
+    VALUES (TG_ARGV[0], OLD.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_requests_touch_updated_at ON t_p26758318_mortgage_support_pro.requests;
+CREATE TRIGGER trg_requests_touch_updated_at
+  BEFORE UPDATE ON t_p26758318_mortgage_support_pro.requests
+  FOR EACH ROW EXECUTE FUNCTION t_p26758318_mortgage_support_pro.touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_clients_touch_updated_at ON t_p26758318_mortgage_support_pro.clients;
+CREATE TRIGGER trg_clients_touch_updated_at
+  BEFORE UPDATE ON t_p26758318_mortgage_support_pro.clients
+  FOR EACH ROW EXECUTE FUNCTION t_p26758318_mortgage_support_pro.touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_requests_tombstone ON t_p26758318_mortgage_support_pro.requests;
+CREATE TRIGGER trg_requests_tombstone
+  AFTER DELETE ON t_p26758318_mortgage_support_pro.requests
+  FOR EACH ROW EXECUTE FUNCTION t_p26758318_mortgage_support_pro.record_crm_tombstone('request');
+
+DROP TRIGGER IF EXISTS trg_clients_tombstone ON t_p26758318_mortgage_support_pro.clients;
+CREATE TRIGGER trg_clients_tombstone
+  AFTER DELETE ON t_p26758318_mortgage_support_pro.clients
+  FOR EACH ROW EXECUTE FUNCTION t_p26758318_mortgage_support_pro.record_crm_tombstone('client');
+
+-- Keyset по (updated_at, id) для выборки изменений после курсора
+CREATE INDEX IF NOT EXISTS idx_requests_updated_at
+  ON t_p26758318_mortgage_support_pro.requests (updated_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_clients_updated_at
+  ON t_p26758318_mortgage_support_pro.clients (updated_at, id);
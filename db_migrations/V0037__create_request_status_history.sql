@@ -0,0 +1,46 @@
+-- История переходов заявок по статусам: время в каждой стадии воронки для crm-api action=pipeline_stats
+CREATE TABLE IF NOT EXISTS t_p26758318_mortgage_support_pro.request_status_history (
+    id SERIAL PRIMARY KEY,
+    request_id INTEGER NOT NULL REFERENCES t_p26758318_mortgage_support_pro.requests(id) ON DELETE CASCADE,
+    status VARCHAR(50),
+    entered_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    left_at TIMESTAMP
+);
+
+COMMENT ON COLUMN t_p26758318_mortgage_support_pro.request_status_history.left_at IS 'NULL — заявка сейчас в этой стадии';
+
+-- Текущая стадия существующих заявок; для уже продвинутых время входа — последнее изменение заявки
+INSERT INTO t_p26758318_mortgage_support_pro.request_status_history (request_id, status, entered_at)
+SELECT r.id, r.status, CASE WHEN r.status = 'new' THEN r.created_at ELSE COALESCE(r.updated_at, r.created_at) END
+FROM t_p26758318_mortgage_support_pro.requests r
+WHERE NOT EXISTS (
+    SELECT 1 FROM t_p26758318_mortgage_support_pro.request_status_history h WHERE h.request_id = r.id
+);
+
+CREATE OR REPLACE FUNCTION t_p26758318_mortgage_support_pro.record_request_status() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO t_p26758318_mortgage_support_pro.request_status_history (request_id, status, entered_at)
+        VALUES (NEW.id, NEW.status, COALESCE(NEW.created_at, CURRENT_TIMESTAMP));
+    ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+        UPDATE t_p26758318_mortgage_support_pro.request_status_history
+        SET left_at = CURRENT_TIMESTAMP
+        WHERE request_id = NEW.id AND left_at IS NULL;
+        INSERT INTO t_p26758318_mortgage_support_pro.request_status_history (request_id, status)
+        VALUES (NEW.id, NEW.status);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_requests_status_history ON t_p26758318_mortgage_support_pro.requests;
+CREATE TRIGGER trg_requests_status_history
+  AFTER INSERT OR UPDATE OF status ON t_p26758318_mortgage_support_pro.requests
+  FOR EACH ROW EXECUTE FUNCTION t_p26758318_mortgage_support_pro.record_request_status();
+
+CREATE INDEX IF NOT EXISTS idx_request_status_history_request_id
+  ON t_p26758318_mortgage_support_pro.request_status_history (request_id)
+  WHERE left_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_request_status_history_status
+  ON t_p26758318_mortgage_support_pro.request_status_history (status, left_at);
@@ -0,0 +1,16 @@
+-- Заметки индексируются конфигурацией simple, как и запрос search_clients (префиксы to_tsquery('simple', 'слово:*')):
+-- с 'russian' в индексе лежала основа "квартир", и префикс "квартиру:*" её не находил
+DROP INDEX IF EXISTS t_p26758318_mortgage_support_pro.idx_clients_search_vector;
+
+ALTER TABLE t_p26758318_mortgage_support_pro.clients DROP COLUMN IF EXISTS search_vector;
+
+ALTER TABLE t_p26758318_mortgage_support_pro.clients
+  ADD COLUMN search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+      setweight(to_tsvector('simple', COALESCE(name, '') || ' ' || COALESCE(full_name, '')), 'A') ||
+      setweight(to_tsvector('simple', COALESCE(email, '')), 'B') ||
+      setweight(to_tsvector('simple', COALESCE(notes, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clients_search_vector
+  ON t_p26758318_mortgage_support_pro.clients USING gin (search_vector);
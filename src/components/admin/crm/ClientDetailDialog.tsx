@@ -137,7 +137,7 @@ export default function ClientDetailDialog({ client, open, onClose, apiUrl }: Cl
         }),
       });
       const data = await res.json();
-      setSendResult({ sent: data.sent || [], errors: data.errors || [] });
+      setSendResult({ sent: data.queued || data.sent || [], errors: data.errors || (data.error ? [data.error] : []) });
     } finally {
       setSending(false);
     }
@@ -407,7 +407,7 @@ export default function ClientDetailDialog({ client, open, onClose, apiUrl }: Cl
               <div className="flex items-start gap-3 bg-green-50 border border-green-200 rounded-lg p-3">
                 <Icon name="CheckCircle2" size={20} className="text-green-600 mt-0.5 flex-shrink-0" />
                 <div>
-                  <p className="font-medium text-green-800">Успешно отправлено!</p>
+                  <p className="font-medium text-green-800">Подборка поставлена в отправку</p>
                   <p className="text-sm text-green-600 mt-0.5">
                     {sendResult.sent.map(c => c === 'email' ? '📧 Email' : '✈️ Telegram').join(', ')}
                   </p>